@@ -1,37 +1,113 @@
 #!/usr/bin/python3
 
+import asyncio
+import inspect
 import json
 import sys
 import struct
-from typing import Any, Callable, Optional
+from concurrent.futures import Executor
+from itertools import count
+from typing import Any, BinaryIO, Callable, Optional
+
+HEADER = struct.Struct("=I")
+
+# Limits of the native messaging protocol
+MAX_INCOMING_LENGTH = 64 * 1024 * 1024
+MAX_OUTGOING_LENGTH = 1024 * 1024
+
+# Raised for frames which can't be decoded, the stream stays usable for the next message
+class MessageError(ValueError):
+    pass
+
+# The extension sends some objects as JSON strings inside the message, these are decoded in place
+def decodeNested(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: decodeNested(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [decodeNested(item) for item in value]
+    elif isinstance(value, str) and len(value) >= 2 and value[0] == "{" and value[-1] == "}":
+        try:
+            return decodeNested(json.loads(value))
+        except ValueError:
+            return value
+    return value
+
+def decodeMessage(data: bytes | memoryview) -> Any:
+    try:
+        message = json.loads(str(data, "utf-8"))
+        return decodeNested(message)
+    # Arrays nested a few thousand levels deep exceed the recursion limit of the decoder
+    except (ValueError, RecursionError) as e:
+        raise MessageError(f"Message is not valid JSON ({e})")
+
+# Returns the length-prefixed frame of a message
+def encodeMessage(message: Any, max_length: int = MAX_OUTGOING_LENGTH) -> bytes:
+    encoded_content = json.dumps(message).encode("utf-8")
+    if len(encoded_content) > max_length:
+        raise MessageError(f"Message of {len(encoded_content)} bytes exceeds the limit of {max_length}")
+    return HEADER.pack(len(encoded_content)) + encoded_content
 
 class BrowserAPI:
 
     CallbackType = Callable[[Any], bool]
 
-    def __init__(self):
+    MAX_INCOMING_LENGTH = MAX_INCOMING_LENGTH
+    MAX_OUTGOING_LENGTH = MAX_OUTGOING_LENGTH
+
+    # Initial size of the read buffer, it grows to fit the largest message received
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, input: Optional[BinaryIO] = None, output: Optional[BinaryIO] = None):
+        self.input = input if input is not None else sys.stdin.buffer
+        self.output = output if output is not None else sys.stdout.buffer
+        self._buffer = bytearray(self.BUFFER_SIZE)
         self.setCallback(lambda message : True)
 
-    def _getMessage(self):
-        raw_length = sys.stdin.buffer.read(4)
+    # Fills the start of the read buffer with exactly `length` bytes and returns a view of them
+    def _readExactly(self, length: int) -> memoryview:
+        if length > len(self._buffer):
+            self._buffer = bytearray(max(length, len(self._buffer) * 2))
 
-        if not raw_length:
-            sys.exit(0)
-        
-        message_length = struct.unpack('=I', raw_length)[0]
-        message = sys.stdin.buffer.read(message_length).decode("utf-8")
+        view = memoryview(self._buffer)[:length]
+        read = 0
+        while read < length:
+            received = self.input.readinto(view[read:])
+            if not received:
+                if read == 0:
+                    raise EOFError()
+                raise MessageError(f"Stream ended {length - read} bytes before the end of a frame")
+            read += received
+
+        return view
+
+    def _skip(self, length: int):
+        while length > 0:
+            length -= len(self._readExactly(min(length, len(self._buffer))))
 
-        while ("\\\"" in message):
-            message = message.replace("\\\"", "\"")
-        message = message.replace("\"{", "{").replace("}\"", "}")
+    # Reads the next message, raises EOFError once the browser closed the stream
+    def readMessage(self) -> Any:
+        message_length = HEADER.unpack(self._readExactly(HEADER.size))[0]
 
-        return json.loads(message)
+        if message_length > self.MAX_INCOMING_LENGTH:
+            self._skip(message_length)
+            raise MessageError(f"Message of {message_length} bytes exceeds the limit of {self.MAX_INCOMING_LENGTH}")
 
-    def sendMessage(self, message):
-        encoded_content = json.dumps(message).encode("utf-8")
-        sys.stdout.buffer.write(struct.pack('=I', len(encoded_content)))
-        sys.stdout.buffer.write(struct.pack(str(len(encoded_content))+"s",encoded_content))
-        sys.stdout.buffer.flush()
+        return decodeMessage(self._readExactly(message_length))
+
+    def _getMessage(self):
+        try:
+            return self.readMessage()
+        except EOFError:
+            sys.exit(0)
+
+    # Writes a message, which is only guaranteed to be sent after flush() unless `flush` is set
+    def sendMessage(self, message, flush: bool = True):
+        self.output.write(encodeMessage(message, self.MAX_OUTGOING_LENGTH))
+        if flush:
+            self.output.flush()
+
+    def flush(self):
+        self.output.flush()
 
     def setCallback(self, callback: CallbackType):
         self.message_received_callback = callback
@@ -39,12 +115,186 @@ class BrowserAPI:
     def getCallback(self) -> CallbackType:
         return self.message_received_callback
 
+    # Malformed messages are reported on stderr and skipped, since stdout belongs to the browser
     def listenForMessages(self, callback: Optional[CallbackType] = None, passthrough: bool = True) -> Any:
         while True:
-            message = self._getMessage()
+            # Messages sent without flushing by the previous callback go out before waiting for the next one
+            self.flush()
+            try:
+                message = self._getMessage()
+            except MessageError as e:
+                sys.stderr.write(f"Skipping malformed message ({e})\n")
+                continue
+
             callback = self.getCallback() if callback is None else callback
 
             if not callback(message):
+                self.flush()
                 return message
             elif passthrough and callback != self.getCallback():
-                self.getCallback()(message)
\ No newline at end of file
+                self.getCallback()(message)
+
+# Asyncio counterpart of BrowserAPI, which handles several messages at once.
+# Messages are read by a coroutine into a queue of QUEUE_SIZE entries, reading pauses while it is full so that the
+# browser's side of the pipe fills up instead of memory. WORKER_COUNT tasks pass them to the handler concurrently.
+# Coroutine handlers run on the event loop and other callables on `executor`. If a message has an "id", whatever
+# the handler returns is sent back as {"id": ..., "result": ...}, or {"id": ..., "error": ...} if it raised, in the
+# order handlers finish.
+class AsyncBrowserAPI:
+
+    HandlerType = Callable[[Any], Any]
+
+    MAX_INCOMING_LENGTH = MAX_INCOMING_LENGTH
+    MAX_OUTGOING_LENGTH = MAX_OUTGOING_LENGTH
+
+    QUEUE_SIZE = 32
+    WORKER_COUNT = 8
+    ID_KEY = "id"
+    # Bytes read at a time while skipping a message over the size limit
+    SKIP_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, handler: Optional[HandlerType] = None, input: Optional[BinaryIO] = None, output: Optional[BinaryIO] = None, executor: Optional[Executor] = None):
+        self.input = input if input is not None else sys.stdin.buffer
+        self.output = output if output is not None else sys.stdout.buffer
+        self.executor = executor
+        self.setHandler(handler if handler is not None else lambda message : None)
+
+        # Requests sent by request() which are waiting for a response, by ID
+        self._requests: dict[str, asyncio.Future] = {}
+        self._request_ids = count(1)
+        self._flush_scheduled = False
+
+    def setHandler(self, handler: HandlerType):
+        self.handler = handler
+
+    # Reads and handles messages until the browser closes the stream, then waits for queued messages to be handled
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(self.QUEUE_SIZE)
+
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), self.input)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.WORKER_COUNT)]
+
+        try:
+            while True:
+                try:
+                    message = await self._readMessage(reader)
+                except EOFError:
+                    break
+                except MessageError as e:
+                    sys.stderr.write(f"Skipping malformed message ({e})\n")
+                    continue
+
+                if not self._resolveRequest(message):
+                    await queue.put(message)
+
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            transport.close()
+
+            for future in self._requests.values():
+                if not future.done():
+                    future.set_exception(EOFError("The browser closed the connection"))
+            self._requests.clear()
+            self.flush()
+
+    async def _readMessage(self, reader: asyncio.StreamReader) -> Any:
+        try:
+            header = await reader.readexactly(HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if len(e.partial) == 0:
+                raise EOFError()
+            raise MessageError("Stream ended inside a frame header")
+
+        message_length = HEADER.unpack(header)[0]
+
+        try:
+            if message_length > self.MAX_INCOMING_LENGTH:
+                remaining = message_length
+                while remaining > 0:
+                    remaining -= len(await reader.readexactly(min(remaining, self.SKIP_CHUNK_SIZE)))
+                raise MessageError(f"Message of {message_length} bytes exceeds the limit of {self.MAX_INCOMING_LENGTH}")
+
+            data = await reader.readexactly(message_length)
+        except asyncio.IncompleteReadError as e:
+            raise MessageError(f"Stream ended {message_length - len(e.partial)} bytes before the end of a frame")
+
+        return decodeMessage(data)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            message = await queue.get()
+            try:
+                await self._handle(message)
+            except Exception as e:
+                sys.stderr.write(f"Handling message failed ({e})\n")
+            finally:
+                queue.task_done()
+
+    async def _handle(self, message: Any):
+        handler = self.handler
+        error: str | None = None
+        result = None
+
+        try:
+            if inspect.iscoroutinefunction(handler):
+                result = await handler(message)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, handler, message)
+                if inspect.isawaitable(result):
+                    result = await result
+        except Exception as e:
+            error = str(e)
+
+        if isinstance(message, dict) and self.ID_KEY in message:
+            if error is None:
+                try:
+                    self.send({self.ID_KEY: message[self.ID_KEY], "result": result})
+                    return
+                # The browser still gets a response if the result can't be sent
+                except (TypeError, ValueError) as e:
+                    error = f"Result could not be sent ({e})"
+            self.send({self.ID_KEY: message[self.ID_KEY], "error": error})
+        elif error is not None:
+            sys.stderr.write(f"Handling message failed ({error})\n")
+
+    def _resolveRequest(self, message: Any) -> bool:
+        if not isinstance(message, dict):
+            return False
+
+        request_id = message.get(self.ID_KEY)
+        if not isinstance(request_id, str) or not request_id in self._requests:
+            return False
+
+        future = self._requests.pop(request_id)
+        if not future.done():
+            future.set_result(message)
+        return True
+
+    # Queues a message, messages sent during the same event loop iteration are written with a single flush.
+    # Must be called from the event loop thread.
+    def send(self, message: Any):
+        self.output.write(encodeMessage(message, self.MAX_OUTGOING_LENGTH))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self._flush_scheduled = False
+        self.output.flush()
+
+    # Sends a message with a new ID and returns the browser's response, which has to carry the same ID
+    async def request(self, message: dict, timeout: Optional[float] = None) -> dict:
+        request_id = f"host-{next(self._request_ids)}"
+        future = asyncio.get_running_loop().create_future()
+        self._requests[request_id] = future
+
+        try:
+            self.send(message | {self.ID_KEY: request_id})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._requests.pop(request_id, None)
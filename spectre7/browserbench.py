@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# Benchmarks and fuzzes the BrowserAPI wire format by running a host on a background thread, connected through pipes
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import string
+import sys
+import time
+from queue import Queue
+from threading import Thread
+from typing import Any
+
+from spectre7.browserapi import HEADER, AsyncBrowserAPI, BrowserAPI
+from spectre7.stats import summarise
+
+"""
+
+Flags:
+-i <names>: Comma-separated implementations to measure [sync, async] (default sync,async)
+-b <sizes>: Comma-separated message sizes in bytes (default 64,4096,65536,524288)
+-d <depths>: Comma-separated nesting depths of JSON strings inside messages (default 0,4)
+-n <count>: Messages sent per size and depth when measuring throughput (default 200)
+-l <count>: Round trips measured per size and depth (default 50)
+-f <count>: Fuzzed frames per implementation (default 200)
+-s <seed>: Seed of the fuzzer (default 0)
+-o <path>: Write results to a file instead of stdout
+
+Every implementation echoes each message it receives, so results are comparable between them.
+Results are a single JSON object so that runs can be compared.
+
+"""
+
+IMPLEMENTATIONS = ("sync", "async")
+
+# Seconds a host may take to answer or to exit after its input was closed before it is considered hung
+TIMEOUT = 10.0
+
+# Fewer messages are sent for large sizes so that each measurement sends at most this many bytes
+BYTE_BUDGET = 32 * 1024 * 1024
+
+# Limit of incoming messages while fuzzing, so that oversized frames stay cheap to generate
+FUZZ_MAX_INCOMING_LENGTH = 64 * 1024
+
+# Fuzzed frames after which the host can read the next frame, and frames which end the stream
+RECOVERABLE_CASES = ("invalid_json", "invalid_utf8", "deep_nesting", "bitflip", "oversized", "empty")
+TERMINAL_CASES = ("truncated_header", "truncated_body", "garbage")
+
+def encodeFrame(data: bytes) -> bytes:
+    return HEADER.pack(len(data)) + data
+
+# Returns a message which encodes to roughly `size` bytes, with its data wrapped in `depth` levels of JSON strings
+# like the extension sends them
+def makeMessage(size: int, depth: int, index: int, filler: str) -> dict:
+    message: dict = {"index": index, "data": filler[:size]}
+    for level in range(depth):
+        message = {"level": level, "payload": json.dumps(message)}
+    return message
+
+# Runs an implementation on a background thread and echoes every message it receives.
+# Replies are read by another thread and queued as (time received, message), followed by None once the host exited.
+class EchoHost:
+
+    def __init__(self, implementation: str, max_incoming_length: int | None = None):
+        self.implementation = implementation
+        self.max_incoming_length = max_incoming_length
+        self.error: BaseException | None = None
+        self.replies: Queue = Queue()
+
+        host_input, input = os.pipe()
+        output, host_output = os.pipe()
+        self._input = open(input, "wb")
+        self._output = open(output, "rb")
+        self._host_input = open(host_input, "rb")
+        self._host_output = open(host_output, "wb")
+
+        self._host_thread = Thread(target=self._runHost, daemon=True)
+        self._reader_thread = Thread(target=self._readReplies, daemon=True)
+        self._host_thread.start()
+        self._reader_thread.start()
+
+    def _runHost(self):
+        try:
+            if self.implementation == "sync":
+                api = BrowserAPI(self._host_input, self._host_output)
+                if self.max_incoming_length is not None:
+                    api.MAX_INCOMING_LENGTH = self.max_incoming_length
+
+                def echo(message: Any) -> bool:
+                    api.sendMessage(message)
+                    return True
+
+                api.listenForMessages(echo)
+
+            elif self.implementation == "async":
+                async def echo(message: Any):
+                    api.send(message)
+
+                api = AsyncBrowserAPI(echo, self._host_input, self._host_output)
+                if self.max_incoming_length is not None:
+                    api.MAX_INCOMING_LENGTH = self.max_incoming_length
+                asyncio.run(api.run())
+
+            else:
+                raise ValueError(f"Unknown implementation '{self.implementation}'")
+
+        # BrowserAPI exits once the stream ends
+        except SystemExit as e:
+            if e.code not in (0, None):
+                self.error = e
+        except BaseException as e:
+            self.error = e
+        finally:
+            self._host_input.close()
+            self._host_output.close()
+
+    def _readReplies(self):
+        try:
+            while True:
+                header = self._output.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                data = self._output.read(HEADER.unpack(header)[0])
+                self.replies.put((time.perf_counter(), json.loads(data)))
+        finally:
+            self._output.close()
+            self.replies.put(None)
+
+    def send(self, frame: bytes):
+        self._input.write(frame)
+        self._input.flush()
+
+    def getReply(self) -> tuple[float, Any]:
+        reply = self.replies.get(timeout=TIMEOUT)
+        if reply is None:
+            raise EOFError("The host exited before replying")
+        return reply
+
+    # Closes the host's input and returns False if it didn't exit in time
+    def close(self) -> bool:
+        try:
+            self._input.close()
+        # The host already closed its side, which is reported through `error`
+        except BrokenPipeError:
+            pass
+        self._host_thread.join(TIMEOUT)
+        if self._host_thread.is_alive():
+            return False
+        self._reader_thread.join(TIMEOUT)
+        return True
+
+def benchmarkThroughput(implementation: str, size: int, depth: int, count: int, round_trips: int, filler: str) -> dict:
+    count = max(10, min(count, BYTE_BUDGET // max(size, 1)))
+    frames = [encodeFrame(json.dumps(makeMessage(size, depth, i, filler)).encode("utf-8")) for i in range(count)]
+    frame_bytes = sum(len(frame) for frame in frames)
+
+    host = EchoHost(implementation)
+
+    def write():
+        for frame in frames:
+            host.send(frame)
+
+    start = time.perf_counter()
+    writer = Thread(target=write, daemon=True)
+    writer.start()
+    for _ in range(count):
+        host.getReply()
+    elapsed = time.perf_counter() - start
+    writer.join()
+
+    latencies: list[float] = []
+    for frame in frames[:round_trips]:
+        start = time.perf_counter()
+        host.send(frame)
+        received, _ = host.getReply()
+        latencies.append(received - start)
+
+    if not host.close():
+        raise RuntimeError(f"The {implementation} host did not exit after its input was closed")
+    if host.error is not None:
+        raise RuntimeError(f"The {implementation} host failed ({host.error!r})")
+
+    return {
+        "messages": count,
+        "frame_bytes": frame_bytes // count,
+        "messages_per_second": count / elapsed,
+        "bytes_per_second": frame_bytes / elapsed,
+        "latency_seconds": summarise(latencies),
+    }
+
+def makeFuzzFrame(case: str, rng: random.Random, filler: str) -> bytes:
+    if case == "invalid_json":
+        return encodeFrame("".join(rng.choices(string.printable, k=rng.randint(1, 256))).encode("utf-8"))
+    elif case == "invalid_utf8":
+        return encodeFrame(b'{"data": "' + bytes(rng.choices(range(0x80, 0x100), k=rng.randint(1, 64))) + b'"}')
+    elif case == "deep_nesting":
+        depth = rng.randint(500, 20000)
+        return encodeFrame(b"[" * depth + b"]" * depth)
+    elif case == "bitflip":
+        data = bytearray(json.dumps(makeMessage(rng.randint(0, 1024), rng.randint(0, 4), 0, filler)).encode("utf-8"))
+        for _ in range(rng.randint(1, 8)):
+            data[rng.randrange(len(data))] ^= 1 << rng.randrange(8)
+        return encodeFrame(bytes(data))
+    elif case == "oversized":
+        return encodeFrame(b" " * rng.randint(FUZZ_MAX_INCOMING_LENGTH + 1, FUZZ_MAX_INCOMING_LENGTH * 4))
+    elif case == "empty":
+        return encodeFrame(b"")
+    elif case == "truncated_header":
+        return rng.randbytes(rng.randint(1, HEADER.size - 1))
+    elif case == "truncated_body":
+        frame = encodeFrame(json.dumps(makeMessage(rng.randint(1, 1024), 0, 0, filler)).encode("utf-8"))
+        return frame[:rng.randint(HEADER.size, len(frame) - 1)]
+    elif case == "garbage":
+        return rng.randbytes(rng.randint(1, 1024))
+    raise ValueError(f"Unknown fuzz case '{case}'")
+
+# Sends one malformed frame to a new host per case. Recoverable frames are followed by a valid message which has
+# to be echoed. Every host has to exit without raising once its input is closed.
+def fuzz(implementation: str, cases: int, seed: int, filler: str) -> dict:
+    rng = random.Random(seed)
+    outcomes: dict[str, dict[str, int]] = {case: {} for case in RECOVERABLE_CASES + TERMINAL_CASES}
+    failures: list[dict] = []
+    stderr = io.StringIO()
+
+    with contextlib.redirect_stderr(stderr):
+        for index in range(cases):
+            case = rng.choice(RECOVERABLE_CASES + TERMINAL_CASES)
+            frame = makeFuzzFrame(case, rng, filler)
+            ping = {"ping": index}
+
+            frames = [frame]
+            if case in RECOVERABLE_CASES:
+                frames.append(encodeFrame(json.dumps(ping).encode("utf-8")))
+
+            host = EchoHost(implementation, FUZZ_MAX_INCOMING_LENGTH)
+
+            # A host which stops reading would block the writer once the pipe is full
+            def write():
+                try:
+                    for frame in frames:
+                        host.send(frame)
+                except BrokenPipeError:
+                    pass
+
+            writer = Thread(target=write, daemon=True)
+            writer.start()
+            writer.join(TIMEOUT)
+
+            if writer.is_alive() or not host.close():
+                outcome = "hang"
+            elif host.error is not None:
+                outcome = "crash"
+            else:
+                replies = []
+                while (reply := host.replies.get(timeout=TIMEOUT)) is not None:
+                    replies.append(reply[1])
+                outcome = "ok" if case in TERMINAL_CASES or ping in replies else "lost"
+
+            outcomes[case][outcome] = outcomes[case].get(outcome, 0) + 1
+            if outcome != "ok":
+                failures.append({
+                    "case": case,
+                    "outcome": outcome,
+                    "error": repr(host.error) if host.error is not None else None,
+                    "frame": frame[:64].hex(),
+                })
+
+    return {
+        "cases": cases,
+        "seed": seed,
+        "failed": len(failures),
+        "outcomes": outcomes,
+        "reported_errors": stderr.getvalue().count("\n"),
+        "failures": failures[:10],
+    }
+
+def run(implementations: list[str], sizes: list[int], depths: list[int], count: int, round_trips: int, fuzz_cases: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    filler = "".join(rng.choices(string.ascii_letters + string.digits + " ", k=max(sizes + [1024])))
+
+    ret = {
+        "sizes": sizes,
+        "depths": depths,
+        "python": sys.version.split()[0],
+        "time": time.time(),
+    }
+
+    for implementation in implementations:
+        throughput = {}
+        for size in sizes:
+            for depth in depths:
+                throughput[f"{size}/{depth}"] = benchmarkThroughput(implementation, size, depth, count, round_trips, filler)
+
+        ret[implementation] = {
+            "throughput": throughput,
+            "fuzz": fuzz(implementation, fuzz_cases, seed, filler),
+        }
+
+    return ret
+
+def main():
+    args = sys.argv[1:]
+
+    options = {"-n": 200, "-l": 50, "-f": 200, "-s": 0}
+    lists = {"-b": [64, 4096, 65536, 524288], "-d": [0, 4]}
+    implementations = list(IMPLEMENTATIONS)
+    output_path: str | None = None
+
+    i = 0
+    while i < len(args):
+        if args[i] in options:
+            options[args[i]] = int(args[i + 1])
+        elif args[i] in lists:
+            lists[args[i]] = [int(value) for value in args[i + 1].split(",")]
+        elif args[i] == "-i":
+            implementations = [name.strip().lower() for name in args[i + 1].split(",")]
+        elif args[i] == "-o":
+            output_path = args[i + 1]
+        else:
+            print(f"Unknown flag '{args[i]}'")
+            return
+        i += 2
+
+    for implementation in implementations:
+        if implementation not in IMPLEMENTATIONS:
+            print(f"Unknown implementation '{implementation}'\nAvailable implementations:\n - " + "\n - ".join(IMPLEMENTATIONS))
+            return
+
+    results = run(implementations, lists["-b"], lists["-d"], options["-n"], options["-l"], options["-f"], options["-s"])
+
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
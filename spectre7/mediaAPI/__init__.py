@@ -0,0 +1 @@
+from spectre7.mediaAPI.api import MediaAPI, Source
@@ -1,27 +1,49 @@
-from os import system
 from typing import Callable
 from pydbus import SessionBus
 import time
-from subprocess import check_output
 from os.path import expanduser
 import json
 from spectre7 import utils
+from spectre7.mediaAPI.config import MediaConfig
+from spectre7.mediaAPI.dlna import DlnaTitleCache
+from spectre7.mediaAPI.volume import VolumeBackend, startVolumeBackend
+from spectre7.mediaAPI.waybar import WaybarNotifier
+from spectre7.mediaAPI.watcher import FileWatcher
+from spectre7.mediaAPI.export import RecordExporter
+from spectre7.mediaAPI import metrics
+from spectre7.mediaAPI.scheduler import UpdateScheduler
 import fnmatch
+from functools import lru_cache
+from collections import OrderedDict
+import heapq
+from threading import Lock
+
+# Maps each bracket character to its (kind, is_close) pairs, `brackets` being a string of open/close pairs like "()[]"
+@lru_cache(maxsize=16)
+def _getBracketTable(brackets: str) -> dict[str, tuple[tuple[int, int], ...]]:
+    table: dict[str, tuple[tuple[int, int], ...]] = {}
+    for i in range(len(brackets) // 2 * 2):
+        table[brackets[i]] = table.get(brackets[i], ()) + (divmod(i, 2),)
+    return table
 
 def removeBrackets(text: str, brackets: str):
+    table = _getBracketTable(brackets)
     count = [0] * (len(brackets) // 2) # count open/close brackets
+    depth = 0 # sum of count
     saved_chars = []
     for character in text:
-        for i, b in enumerate(brackets):
-            if character == b: # found bracket
-                kind, is_close = divmod(i, 2)
-                count[kind] += (-1)**is_close # `+1`: open, `-1`: close
-                if count[kind] < 0: # unbalanced bracket
-                    count[kind] = 0  # keep it
-                else:  # found bracket to remove
-                    break
+        for kind, is_close in table.get(character, ()): # found bracket
+            if not is_close:
+                count[kind] += 1
+                depth += 1
+                break
+            if count[kind] > 0: # found bracket to remove
+                count[kind] -= 1
+                depth -= 1
+                break
+            # unbalanced bracket, keep it
         else: # character is not a [balanced] bracket
-            if not any(count): # outside brackets
+            if depth == 0: # outside brackets
                 saved_chars.append(character)
     return ''.join(saved_chars)
 
@@ -30,19 +52,45 @@ class Source:
 
 class MediaAPI:
 
-    cmd = check_output
+    MPRIS_PREFIX = "org.mpris.MediaPlayer2."
+
+    # Maximum age of cached source properties while signals keep them up to date
+    PROPERTY_CACHE_TTL = 30.0
+    # Polling mode, minimum seconds between checks of the players. Updates in between, which only advance the title
+    # scroll, reuse the properties of the last check.
+    POLL_INTERVAL = UpdateScheduler.PLAYING_INTERVAL
 
     MAX_TITLE_LENGTH = -1
+    # Maximum amount of readable titles kept by getReadableTitle()
+    TITLE_CACHE_SIZE = 256
     HIDE_DELAY = 1.0
 
-    _config: dict = None
+    _config: MediaConfig = None
+    # Loaded but not yet applied, swapped in by the next update() so that an update never sees two configs
+    _pending_config: MediaConfig | None = None
+    # Set by watchConfig()
+    config_watcher: FileWatcher | None = None
+    # Receives a snapshot of the current source whenever its track changes, closed by close()
+    track_exporter: RecordExporter | None = None
+    _exported_track: tuple | None = None
 
     _first_update: bool = True
+    # time.monotonic() of the last check of the players in polling mode
+    _last_poll: float = float("-inf")
+    # Set by requestUpdate() so that the next update checks the players whatever the time since the last check
+    _poll_requested: bool = False
     currentTitleScroll: int = 0
+    # State of the last update, used to schedule the next one
+    playing: bool = False
+    _scrolling: bool = False
     active_media_names: list[str] = []
-    vlc_dlna_cache: any = {}
+    vlc_dlna_cache: DlnaTitleCache | None = None
+    # Created by getVolumeBackend() unless set beforehand
+    volume_backend: VolumeBackend | None = None
+    _volume_backend_started: bool = False
     hide_delay_start_time: int = -1
 
+    # Sources which passed the name, artist and title filters
     sources: list[Source] = []
     current_source: Source | None = None
 
@@ -52,9 +100,49 @@ class MediaAPI:
     setTitleCallback: Callable | None = None
     setVolumeCallback: Callable | None = None
     setPlayingCallback: Callable | None = None
+    # Called with the ID and metadata of the current source, or None and None when there is none
+    setTrackCallback: Callable | None = None
+
+    # Called from the D-Bus signal thread when an update should be run as soon as possible
+    wakeCallback: Callable | None = None
+
+    # Set by enableEvents(), sources are then tracked through NameOwnerChanged instead of ListNames()
+    event_driven: bool = False
+    _available_sources: set[str] | None = None
+    _name_subscription = None
+
+    # Number of blocking D-Bus round trips made so far
+    dbus_calls: int = 0
+
+    # Totals across all sources, see Source.getProperty()
+    property_cache_hits: int = 0
+    property_cache_misses: int = 0
 
     bus = SessionBus()
 
+    def __init__(self):
+        # (raw title, artists, config generation) -> readable title
+        self._readable_titles: OrderedDict[tuple, str] = OrderedDict()
+        # Set to None to stop signalling waybar
+        self.waybar_notifier: WaybarNotifier | None = WaybarNotifier()
+
+        # Every listed source which isn't blacklisted by name, keyed by ID
+        self._registry: dict[str, Source] = {}
+        # Sources which passed the artist and title filters
+        self._accepted: dict[str, Source] = {}
+        # IDs which were listed but are blacklisted by name
+        self._ignored_ids: set[str] = set()
+        # Keys of _registry and _ignored_ids
+        self._known_ids: set[str] = set()
+        # IDs of sources whose properties changed since the last update
+        self._dirty_sources: set[str] = set()
+        self._dirty_lock = Lock()
+        # Heap of (not playing, -last_activity, seq, version, source)
+        self._priority: list[tuple] = []
+        self._source_seq: int = 0
+        self._dbus_proxy = None
+        self._config_lock = Lock()
+
     @staticmethod
     def matchRuleShort(text: str, match: str) -> bool:
         return fnmatch.fnmatch(text, match)
@@ -63,32 +151,76 @@ class MediaAPI:
     def getConfigPath():
         return expanduser("~/.config/mediapanel-config.json")
 
+    # Filters tracked sources again with the new config, keeping their proxies and cached properties
     def onConfigChanged(self):
-        self.sources = []
-        self.current_source = None
+        self._readable_titles.clear()
+
+        for source_id in list(self._known_ids):
+            blacklisted = len(source_id.strip()) == 0 or self._config.isSourceBlacklisted(source_id)
+            if (source_id in self._registry):
+                if (blacklisted):
+                    self._removeSource(source_id)
+                    self._ignored_ids.add(source_id)
+            elif (not blacklisted):
+                self._ignored_ids.discard(source_id)
+                self._markDirty(self._addSource(source_id))
+
+        # Accepted sources are checked against their cached metadata, rejected ones once it is refreshed by the next update
+        for source in list(self._registry.values()):
+            if (not source.accepted):
+                self._markDirty(source)
+            elif (not source.passesFilters(self)):
+                self._setAccepted(source, False)
+
+        self._first_update = True
         self.beginHide()
 
+    # Reads and compiles the config file on the calling thread, it is applied by the next update()
     def loadConfig(self, message_callback: Callable = None):
-        original = self._config
+        metrics.count("config_reloads")
         try:
             f = open(self.getConfigPath(), "r")
-            self._config = json.loads(f.read())
+            config = MediaConfig(json.loads(f.read()))
             f.close()
-            if (message_callback):
-                message_callback(f"Config file at '{self.getConfigPath()}' loaded successfully")
         except Exception as e:
-            self._config = original
             if (message_callback):
                 message_callback(utils.format_colour("red", str(e)))
+                return
             else:
                 raise e
 
-        self.onConfigChanged()
+        with self._config_lock:
+            self._pending_config = config
+
+        if (message_callback):
+            message_callback(f"Config file at '{self.getConfigPath()}' loaded successfully")
+        self.requestUpdate()
+
+    def _applyPendingConfig(self):
+        with self._config_lock:
+            config = self._pending_config
+            self._pending_config = None
+
+        if (config is not None):
+            self._config = config
+            self.onConfigChanged()
+
+    # Reloads the config whenever its file changes
+    def watchConfig(self):
+        if (self.config_watcher is not None):
+            return
+        self.config_watcher = FileWatcher(self.getConfigPath(), lambda: self.loadConfig(utils.log))
+        self.config_watcher.start()
+
+    def unwatchConfig(self):
+        if (self.config_watcher is not None):
+            self.config_watcher.stop()
+            self.config_watcher = None
 
     def saveConfig(self, message_callback: Callable = None):
         try:
             f = open(self.getConfigPath(), "w")
-            f.write(json.dumps(self._config))
+            f.write(json.dumps(self._config.data))
             if (message_callback):
                 message_callback(f"Config file at '{self.getConfigPath()}' saved successfully")
         except Exception as e:
@@ -97,196 +229,445 @@ class MediaAPI:
             else:
                 raise e
 
+    # Returns the DLNA title cache for the configured dlna_command, or None if there is none
+    def getDlnaCache(self) -> DlnaTitleCache | None:
+        command = self._config.dlna_command if self._config is not None else None
+
+        if (self.vlc_dlna_cache is not None and self.vlc_dlna_cache.command != command):
+            self.vlc_dlna_cache.close()
+            self.vlc_dlna_cache = None
+
+        if (self.vlc_dlna_cache is None and command is not None):
+            self.vlc_dlna_cache = DlnaTitleCache(command, on_resolved=lambda url, title: self.requestUpdate())
+
+        return self.vlc_dlna_cache
+
+    # Releases resources held by the API, it should not be updated afterwards
+    def close(self):
+        self.unwatchConfig()
+
+        if (self.track_exporter is not None):
+            self.track_exporter.close()
+            self.track_exporter = None
+
+        if (self.waybar_notifier is not None):
+            self.waybar_notifier.close()
+
+        if (self._volume_backend_started):
+            self.volume_backend.stop()
+            self._volume_backend_started = False
+
+        if (self.vlc_dlna_cache is not None):
+            self.vlc_dlna_cache.close()
+            self.vlc_dlna_cache = None
+
     def beginHide(self):
         self.hide_delay_start_time = time.time()
 
+    # Time at which the pending hide takes effect, or None
+    def getHideDeadline(self) -> float | None:
+        if (self.hide_delay_start_time < 0):
+            return None
+        return self.hide_delay_start_time + self.HIDE_DELAY
+
+    def isScrolling(self) -> bool:
+        return self._scrolling
+
     def cancelHide(self):
         self.hide_delay_start_time = -1
     
     def processHide(self):
-        if (self.hide_delay_start_time >= 0 and (time.time() - self.hide_delay_start_time) / 1000.0 > self.HIDE_DELAY):
+        if (self.hide_delay_start_time >= 0 and time.time() - self.hide_delay_start_time >= self.HIDE_DELAY):
             if (self.setVisibleCallback):
                 self.setVisibleCallback(False)
             self.hide_delay_start_time = -1
+            if (self.waybar_notifier is not None):
+                self.waybar_notifier.notify((None, False, False, False, False))
+
+    def _getDBus(self):
+        if (self._dbus_proxy is None):
+            self.dbus_calls += 1
+            metrics.count("dbus_calls")
+            self._dbus_proxy = self.bus.get("org.freedesktop.DBus", "/org/freedesktop/DBus")
+        return self._dbus_proxy
+
+    # Source IDs in the order the bus lists them
+    def _listMprisNames(self, obj = None) -> list[str]:
+        if (obj is None):
+            obj = self._getDBus()
+        self.dbus_calls += 1
+        metrics.count("dbus_calls")
+        return [name[len(self.MPRIS_PREFIX):] for name in obj.ListNames() if name.startswith(self.MPRIS_PREFIX)]
+
+    def _listSourceIds(self) -> list[str]:
+        if (self.event_driven):
+            return list(self._available_sources)
+        return self._listMprisNames()
+
+    # Track players and their properties through D-Bus signals, so that update() only needs to run when something changed.
+    # Signals are only delivered while a GLib main loop is running.
+    def enableEvents(self):
+        if (self.event_driven):
+            return
+
+        obj = self._getDBus()
+        self._name_subscription = obj.NameOwnerChanged.connect(self._onNameOwnerChanged)
+        self._available_sources = set(self._listMprisNames(obj))
+        self.event_driven = True
+
+        # Anything may have changed since the last poll
+        for source in self._registry.values():
+            source.subscribe()
+            self._markDirty(source)
+
+    def disableEvents(self):
+        if (not self.event_driven):
+            return
+
+        self.event_driven = False
+        self._poll_requested = True
+        with self._dirty_lock:
+            self._dirty_sources.clear()
+        self._name_subscription.disconnect()
+        self._name_subscription = None
+        self._available_sources = None
+
+        for source in self._registry.values():
+            source.unsubscribe()
+
+    # Re-list bus names in case a NameOwnerChanged signal was missed
+    def resyncSources(self):
+        if (self.event_driven):
+            self._available_sources = set(self._listMprisNames())
+
+    def getPropertyCacheStats(self) -> dict:
+        return {
+            "hits": self.property_cache_hits,
+            "misses": self.property_cache_misses,
+            "sources": {source.id: {"hits": source.cache_hits, "misses": source.cache_misses} for source in self.sources}
+        }
+
+    def requestUpdate(self):
+        self._poll_requested = True
+        if (self.wakeCallback):
+            self.wakeCallback()
+
+    def _onNameOwnerChanged(self, name: str, old_owner: str, new_owner: str):
+        if (not name.startswith(self.MPRIS_PREFIX) or self._available_sources is None):
+            return
+
+        source_id = name[len(self.MPRIS_PREFIX):]
+        if (new_owner):
+            self._available_sources.add(source_id)
+        else:
+            self._available_sources.discard(source_id)
 
-    def _updateCurrentSource(self) -> bool:
-
-        obj = self.bus.get("org.freedesktop.DBus", "/org/freedesktop/DBus")
-
-        available_sources: list[str] = []
-        for bus in obj.ListNames():
-            if not bus.startswith("org.mpris.MediaPlayer2."):
-                continue
+        self.requestUpdate()
 
-            bus = bus[23:]
+    def _addSource(self, source_id: str) -> Source:
+        source = Source(self, source_id)
+        source._seq = self._source_seq
+        self._source_seq += 1
 
-            if ("source_blacklist" in self._config):
-                blacklisted = False
-                for player in self._config["source_blacklist"]:
-                    if MediaAPI.matchRuleShort(bus, player):
-                        blacklisted = True
-                        break
-                if (blacklisted):
-                    continue
+        self._registry[source_id] = source
+        if (self.event_driven):
+            source.subscribe()
+        return source
 
-            available_sources.append(bus)
+    def _removeSource(self, source_id: str):
+        source = self._registry.pop(source_id)
+        source.unsubscribe()
+        self._setAccepted(source, False)
 
-        new_sources: list[Source] = []
-        current_exists = False
+    def _setAccepted(self, source: Source, accepted: bool):
+        if (source.accepted == accepted):
+            return
 
-        for source_id in available_sources:
-            
-            if (len(source_id.strip()) == 0):
+        source.accepted = accepted
+        if (accepted):
+            self._accepted[source.id] = source
+            self._updatePriority(source)
+        else:
+            del self._accepted[source.id]
+            # A rejected source starts over once accepted again
+            source.last_activity = -1
+            source._priority_key = None
+            if (source == self.current_source):
+                self.current_source = None
+
+        self.sources = list(self._accepted.values())
+
+    # Only tracked with signals, polling checks every source anyway
+    def _markDirty(self, source: Source):
+        if (not self.event_driven):
+            return
+        with self._dirty_lock:
+            self._dirty_sources.add(source.id)
+
+    # Pushes a new heap entry if the (playing, last_activity) key of the source changed, outdated entries are skipped when popped
+    def _updatePriority(self, source: Source):
+        key = (source.getStatus() == 2, source.last_activity)
+        if (key == source._priority_key):
+            return
+
+        source._priority_key = key
+        source._priority_version += 1
+        heapq.heappush(self._priority, (not key[0], -key[1], source._seq, source._priority_version, source))
+
+        if (len(self._priority) > 2 * len(self._accepted) + 32):
+            self._priority = [entry for entry in self._priority if entry[4].accepted and entry[3] == entry[4]._priority_version]
+            heapq.heapify(self._priority)
+
+    # The most recently active playing source, otherwise the most recently active one which was ever current
+    def _selectSource(self) -> Source | None:
+        while len(self._priority) > 0:
+            not_playing, negative_activity, _, version, source = self._priority[0]
+            if (not source.accepted or version != source._priority_version or self._registry.get(source.id) is not source):
+                heapq.heappop(self._priority)
                 continue
 
-            existing_source: Source | None = None
-            for source in self.sources:
-                if (source.id == source_id):
-                    existing_source = source
-                    break
-
-            if (existing_source):
-                if (not existing_source.isTitleBlacklisted(self)):
-                    new_sources.append(existing_source)
-                    if (existing_source == self.current_source):
-                        current_exists = True
-            else:
-                source: Source | None = Source.create(source_id, self)
-                if (source):
-                    new_sources.append(source)
-
-        self.sources = new_sources
+            playing = not not_playing
+            if (playing or -negative_activity >= 0):
+                return source
+            return None
 
-        changed = self.current_source is not None
+        return None
 
-        if (not current_exists):
-            self.current_source = None
+    def _updateCurrentSource(self) -> bool:
 
-        if (len(self.sources) == 0):
-            self.current_source = None
-            return changed
+        previous_source: Source | None = self.current_source
+        # Kept in bus order, which decides the order of sources with the same priority
+        listed = self._listSourceIds()
+        listed_ids = set(listed)
 
-        original_source: Source | None = self.current_source
-        self.current_source = None
+        for source_id in self._known_ids - listed_ids:
+            self._known_ids.discard(source_id)
+            self._ignored_ids.discard(source_id)
+            if (source_id in self._registry):
+                self._removeSource(source_id)
 
-        for source in self.sources:
-            
-            if source.getStatus() != 2:
+        for source_id in listed:
+            if (source_id in self._known_ids):
                 continue
+            self._known_ids.add(source_id)
+            if (len(source_id.strip()) == 0 or self._config.isSourceBlacklisted(source_id)):
+                self._ignored_ids.add(source_id)
+            else:
+                self._markDirty(self._addSource(source_id))
 
-            if (self.current_source and self.current_source.last_activity >= source.last_activity):
+        # Without signals, every source has to be checked for changes
+        if (self.event_driven):
+            with self._dirty_lock:
+                dirty, self._dirty_sources = self._dirty_sources, set()
+        else:
+            dirty = list(self._registry)
+
+        # Metadata of accepted sources is only refreshed for the current one, so only its title can have become blacklisted.
+        # A rejected source is checked again from the next update onwards.
+        rejected: Source | None = None
+        if (self.current_source is not None and self.current_source.isTitleBlacklisted(self)):
+            rejected = self.current_source
+            self._setAccepted(rejected, False)
+            self._markDirty(rejected)
+
+        for source_id in dirty:
+            source = self._registry.get(source_id)
+            if (source is None or source is rejected):
                 continue
-            
-            self.current_source = source
 
-        if self.current_source is None:
-            for source in self.sources:
+            if (source.accepted):
+                self._updatePriority(source)
+            else:
+                source.updateMetadata()
+                self._setAccepted(source, source.passesFilters(self))
 
-                if (source.last_activity < 0):
-                    continue
+        if (len(self._accepted) == 0):
+            self.current_source = None
+            return previous_source is not None
 
-                if (self.current_source and self.current_source.last_activity >= source.last_activity):
-                    continue
-                
-                self.current_source = source
+        # None if the previous source was removed or rejected
+        original_source: Source | None = self.current_source
+        self.current_source = self._selectSource()
+
+        if (self.current_source is None):
+            return original_source is not None
 
-        if self.current_source:
-            self.current_source.updateLastActivity()
+        self.current_source.updateLastActivity()
+        self._updatePriority(self.current_source)
 
         return self.current_source != original_source
 
     # Returns True if the playing media name changed
     def update(self) -> bool:
 
-        if (self._config is None):
+        if (self._config is None and self._pending_config is None):
             self.loadConfig()
 
-            if (self._config is None):
-                return False
-
-        if (self.setVolumeCallback):
-            volume, on = self.getVolumeData()
-            self.setVolumeCallback(volume, on)
-
-        changed: bool = self._updateCurrentSource() or self._first_update
+        self._applyPendingConfig()
+        if (self._config is None):
+            return False
+
+        # Without signals there is no way to know what changed, so properties are only reused until the next check
+        poll = self.event_driven
+        if (not self.event_driven):
+            now = time.monotonic()
+            if (self._first_update or self._poll_requested or now - self._last_poll >= self.POLL_INTERVAL):
+                poll = True
+                self._last_poll = now
+                self._poll_requested = False
+                for source in self._registry.values():
+                    source.invalidateProperties()
+
+        # Volume changes are pushed to setVolumeCallback by the backend
+        if (self.setVolumeCallback and not self._volume_backend_started):
+            self.getVolumeBackend()
+
+        with metrics.timer("update_current_source"):
+            changed: bool = (poll and self._updateCurrentSource()) or self._first_update
         self._first_update = False
         
         if (changed):
             self.currentTitleScroll = 0
 
         if (self.current_source is None):
+            self.playing = False
+            self._scrolling = False
+            if (self.setTrackCallback):
+                with metrics.timer("callbacks"):
+                    self.setTrackCallback(None, None)
             if (changed):
                 self.beginHide()
             self.processHide()
             return changed
 
-        self.current_source.updateMetadata()
+        with metrics.timer("update_metadata"):
+            self.current_source.updateMetadata()
+
+        if (self.track_exporter is not None):
+            self._exportTrackChange()
+
+        if (self.setTrackCallback):
+            with metrics.timer("callbacks"):
+                self.setTrackCallback(self.current_source.id, self.current_source.metadata)
 
+        can_go_next: bool = self.current_source.getProperty("Player", "CanGoNext")
         if (self.setCanGoNextCallback):
-            self.setCanGoNextCallback(self.current_source.getProperty("Player", "CanGoNext"))
+            with metrics.timer("callbacks"):
+                self.setCanGoNextCallback(can_go_next)
 
+        can_go_previous: bool = self.current_source.getProperty("Player", "CanGoPrevious")
         if (self.setCanGoPreviousCallback):
-            self.setCanGoPreviousCallback(self.current_source.getProperty("Player", "CanGoPrevious"))
+            with metrics.timer("callbacks"):
+                self.setCanGoPreviousCallback(can_go_previous)
 
+        playing: bool = self.current_source.getStatus() == 2
+        self.playing = playing
         if (self.setPlayingCallback):
-            self.setPlayingCallback(self.current_source.getStatus() == 2)
+            with metrics.timer("callbacks"):
+                self.setPlayingCallback(playing)
 
+        set_title: str | None = None
+        self._scrolling = False
         if (self.setTitleCallback):
-            title: str = self.current_source.getReadableTitle(self)
-            set_title: str = ""
+            with metrics.timer("readable_title"):
+                title: str = self.current_source.getReadableTitle(self)
 
             if (self.MAX_TITLE_LENGTH > 0 and len(title) > self.MAX_TITLE_LENGTH):
-                set_title = title.slice(self.currentTitleScroll, min(self.currentTitleScroll + self.MAX_TITLE_LENGTH, len(title)))
+                set_title = title[self.currentTitleScroll:self.currentTitleScroll + self.MAX_TITLE_LENGTH]
                 
                 if (len(set_title) < self.MAX_TITLE_LENGTH):
-                    set_title += "   | " + title.slice(0, self.MAX_TITLE_LENGTH - len(set_title))
+                    set_title += "   | " + title[:self.MAX_TITLE_LENGTH - len(set_title)]
                 
                 self.currentTitleScroll = (self.currentTitleScroll + 1) % len(title)
+                self._scrolling = True
             else:
                 set_title = title
 
-            self.setTitleCallback(set_title)
+            with metrics.timer("callbacks"):
+                self.setTitleCallback(set_title)
         
         if (self.setVisibleCallback):
-            self.setVisibleCallback(True)
+            with metrics.timer("callbacks"):
+                self.setVisibleCallback(True)
         
         self.cancelHide()
-        system("pkill -RTMIN+8 waybar")
+        if (self.waybar_notifier is not None):
+            self.waybar_notifier.notify((set_title, playing, can_go_next, can_go_previous, True))
 
         return changed
 
+    # Snapshots of every tracked source, built from cached state without any D-Bus calls
+    def getSnapshot(self) -> list[dict]:
+        current_source = self.current_source
+        ret = []
+        for source in sorted(list(self._registry.values()), key=lambda source: source._seq):
+            snapshot = source.getSnapshot(self)
+            snapshot["current"] = source is current_source
+            ret.append(snapshot)
+        return ret
+
+    def _exportTrackChange(self):
+        source = self.current_source
+        artists = source.metadata["artist"]
+        track = (source.id, source.metadata["trackid"], source.metadata["title"], tuple(artists) if artists is not None else None)
+        if (track == self._exported_track):
+            return
+
+        self._exported_track = track
+        record = source.getSnapshot(self)
+        record["time"] = time.time()
+        self.track_exporter.write(record)
+
+    # Media controls return once the player received the call, the state is refreshed by the next update
     def mediaForward(self):
-        self.current_source.player_bus.Next()
-        time.sleep(0.1)
-        self.update()
+        source = self.current_source
+        if (source is not None):
+            source.player_bus.Next()
+            self.requestUpdate()
 
     def mediaBackward(self):
-        self.current_source.player_bus.Previous()
-        time.sleep(0.1)
-        self.update()
+        source = self.current_source
+        if (source is not None):
+            source.player_bus.Previous()
+            self.requestUpdate()
 
     def mediaPlayPause(self):
-        self.current_source.player_bus.PlayPause()
-        time.sleep(0.1)
-        self.update()
+        source = self.current_source
+        if (source is not None):
+            source.player_bus.PlayPause()
+            self.requestUpdate()
 
-    def getVolumeData(self, offset: int = 0) -> tuple[int, bool]:
-        data: str
+    def _onVolumeChanged(self, volume: int, muted: bool):
+        if (self.setVolumeCallback):
+            with metrics.timer("callbacks"):
+                self.setVolumeCallback(volume, muted)
 
-        try:
-            data = self.cmd(["amixer", "get", "Master", "|", "grep", "'Right: '"])
-        except:
-            data = self.cmd(["amixer", "get", "Master", "|", "grep", "'Mono: '"])
+    # Returns the started volume backend, creating one if volume_backend wasn't set
+    def getVolumeBackend(self) -> VolumeBackend:
+        if (self._volume_backend_started):
+            return self.volume_backend
 
-        volume: int = int(data.slice(data.find("[") + 1, data.find("]") - 1))
-        volume = max(0, min(100, volume + offset))
+        if (self.volume_backend is not None):
+            try:
+                self.volume_backend.start(self._onVolumeChanged)
+            except Exception as e:
+                utils.warn(f"Could not start {self.volume_backend.NAME} volume backend, falling back to the first available one ({e})")
+                self.volume_backend = None
+
+        if (self.volume_backend is None):
+            self.volume_backend = startVolumeBackend(self._onVolumeChanged)
+        self._volume_backend_started = True
 
-        on: bool = data.slice(data.rindex("[") + 1, data.rindex("]")) == "on"
+        return self.volume_backend
 
-        return volume, on
+    def getVolumeData(self, offset: int = 0) -> tuple[int, bool]:
+        volume, muted = self.getVolumeBackend().getVolume()
+        volume = max(0, min(100, volume + offset))
+        return volume, not muted
 
+    # Changes are applied in the background, only the latest of several quick calls takes effect
     def setVolume(self, value: int):
-        self.cmd(["amixer", "set", "Master", f"{value}%"])
+        self.getVolumeBackend().setVolume(value)
 
 class Source:
 
@@ -317,20 +698,109 @@ class Source:
 
     last_activity: int = -1
 
+    # Managed by MediaAPI
+    accepted: bool = False
+    _seq: int = 0
+    _priority_key: tuple | None = None
+    _priority_version: int = 0
+
     api: MediaAPI
     id: str
 
     player_bus: object;
+    _subscription = None
+
+    # Interface name -> property values fetched with GetAll
+    _properties: dict[str, dict]
+    _property_times: dict[str, float]
+    cache_hits: int = 0
+    cache_misses: int = 0
 
     def __init__(self, api: MediaAPI, id: str):
         self.api = api
         self.id = id
-        self.player_bus = api.bus.get("org.mpris.MediaPlayer2." + self.id, "/org/mpris/MediaPlayer2")
+        self.metadata = dict(Source.metadata)
+        self._properties = {}
+        self._property_times = {}
+        self.player_bus = api.bus.get(MediaAPI.MPRIS_PREFIX + self.id, "/org/mpris/MediaPlayer2")
+        api.dbus_calls += 1
+        metrics.count("dbus_calls")
+
+    def subscribe(self):
+        if (self._subscription is None):
+            self._subscription = self.player_bus.PropertiesChanged.connect(self._onPropertiesChanged)
+
+    def unsubscribe(self):
+        if (self._subscription is not None):
+            self._subscription.disconnect()
+            self._subscription = None
+
+    def _onPropertiesChanged(self, iface: str, changed: dict, invalidated: list[str]):
+        if (not iface.startswith("org.mpris.MediaPlayer2")):
+            return
+
+        values = self._properties.get(iface)
+        if (values is not None):
+            values.update(changed)
+            for key in invalidated:
+                values.pop(key, None)
+
+        self.api._markDirty(self)
+        self.api.requestUpdate()
 
-    def getProperty(self, iface: str, key: str) -> any:
+    @staticmethod
+    def _getInterfaceName(iface: str) -> str:
         if (iface != ""):
-            iface = "." + iface
-        return self.player_bus.Get("org.mpris.MediaPlayer2" + iface, key)
+            return "org.mpris.MediaPlayer2." + iface
+        return "org.mpris.MediaPlayer2"
+
+    # Fetches every property of the interface in a single call and caches them
+    def fetchProperties(self, iface: str) -> dict:
+        name = Source._getInterfaceName(iface)
+        values = dict(self.player_bus.GetAll(name))
+        self.api.dbus_calls += 1
+        metrics.count("dbus_calls")
+        self._properties[name] = values
+        self._property_times[name] = time.monotonic()
+        return values
+
+    # Drops cached properties of the given interface, or of all interfaces if iface is None
+    def invalidateProperties(self, iface: str | None = None):
+        if (iface is None):
+            self._properties.clear()
+            self._property_times.clear()
+        else:
+            name = Source._getInterfaceName(iface)
+            self._properties.pop(name, None)
+            self._property_times.pop(name, None)
+
+    def getProperty(self, iface: str, key: str) -> any:
+        name = Source._getInterfaceName(iface)
+
+        values = self._properties.get(name)
+        if (values is not None and key in values and time.monotonic() - self._property_times[name] < self.api.PROPERTY_CACHE_TTL):
+            self.cache_hits += 1
+            self.api.property_cache_hits += 1
+            return values[key]
+
+        self.cache_misses += 1
+        self.api.property_cache_misses += 1
+
+        values = self.fetchProperties(iface)
+        if (key in values):
+            return values[key]
+
+        # Some players leave properties out of GetAll
+        self.api.dbus_calls += 1
+        metrics.count("dbus_calls")
+        return self.player_bus.Get(name, key)
+
+    # Returns a cached property regardless of its age, or `default` without fetching it
+    def peekProperty(self, iface: str, key: str, default: any = None) -> any:
+        values = self._properties.get(Source._getInterfaceName(iface))
+        if (values is None):
+            return default
+        return values.get(key, default)
 
     def getStatus(self) -> int:
         match self.getProperty("Player", "PlaybackStatus"):
@@ -338,104 +808,145 @@ class Source:
             case "Paused": return 1
             case _: return 0
 
+    # Built from the cached Metadata property, which is kept current for every source, while self.metadata is only
+    # refreshed for the current one. May run off the update thread, so nothing here writes to the source.
+    def getSnapshot(self, api: MediaAPI) -> dict:
+        raw = self.peekProperty("Player", "Metadata")
+        if (raw is not None):
+            metadata = self._parseMetadata(raw, False)
+            if (metadata["title"] is not None):
+                self.formatTitle(api, metadata, False)
+        else:
+            metadata = dict(self.metadata)
+
+        readable_title = None
+        # Formatted directly, the title cache is only touched by the update thread
+        config = api._config
+        if (metadata["title"] is not None and config is not None):
+            readable_title = Source._formatReadableTitle(config, metadata)
+
+        return {
+            "id": self.id,
+            "status": self.peekProperty("Player", "PlaybackStatus"),
+            "last_activity": self.last_activity,
+            "accepted": self.accepted,
+            "readable_title": readable_title,
+            "metadata": metadata,
+        }
+
     def updateLastActivity(self):
         self.last_activity = time.time()
 
-    def updateMetadata(self):
-        metadata: dict = self.getProperty("Player", "Metadata")
-        
-        for key in self.metadata:
-            self.metadata[key] = None
+    # Maps MPRIS metadata to the keys of Source.metadata
+    def _parseMetadata(self, raw: dict, report_unknown: bool = True) -> dict:
+        metadata = dict.fromkeys(Source.metadata)
 
-        for key in metadata:
+        for key in raw:
             formatted_key = key.split(":", 2)[1]
-            if (not formatted_key in self.metadata):
-                print("Unknown metadata key: " + key)
+            if (not formatted_key in metadata):
+                if (report_unknown):
+                    print("Unknown metadata key: " + key)
                 continue
-            self.metadata[formatted_key] = metadata[key]
+            metadata[formatted_key] = raw[key]
+
+        return metadata
+
+    def updateMetadata(self):
+        metadata = self._parseMetadata(self.getProperty("Player", "Metadata"))
+
+        if (metadata["title"] is not None):
+            self.formatTitle(self.api, metadata)
+
+        # Replaced as a whole so that readers on other threads never see a partly updated track
+        self.metadata = metadata
 
     def toString(self, api: MediaAPI | None = None) -> str:
-        ret: str = f"{self.metadata['title']}\n - Status: {['Stopped', 'Paused', 'Playing'][self.getStatus()]}\n - Last active: {self.last_activity}\n - ID: {self.id}"
+        ret: str = f"{self.metadata['title']}\n - Status: {self.peekProperty('Player', 'PlaybackStatus')}\n - Last active: {self.last_activity}\n - ID: {self.id}"
         if (api):
-            ret += "\n - Current: " + (api.current_source == self).toString()
+            ret += "\n - Current: " + str(api.current_source == self)
         return ret
 
-    def formatTitle(self, api: MediaAPI):
+    # Titles which aren't cached yet are only resolved if `resolve` is set, which must only be done by the update thread
+    def formatTitle(self, api: MediaAPI, metadata: dict, resolve: bool = True):
 
-        url: str = self.metadata["url"]
+        url: str = metadata["url"]
 
-        if (self.id == "vlc" and url is not None and self.metadata["title"] == "audio stream" and "dlna_command" in api._config):
+        if (self.id == "vlc" and url is not None and metadata["title"] == "audio stream"):
+            # Resolved in the background, the source is updated again once the title is available
+            dlna_cache = api.getDlnaCache() if resolve else api.vlc_dlna_cache
+            if (dlna_cache is not None):
+                title = dlna_cache.get(url, resolve)
+                if (title is not None):
+                    metadata["title"] = title
 
-            if (url in api.vlc_dlna_cache):
-                self.metadata["title"] = api.vlc_dlna_cache[url]
-            elif (url.startsWith("http://")):
-                ip: str = url.removeprefix("http://").split("/", 1)[0]
+        title: str = metadata["title"].removeprefix("\"").removesuffix("\"").replace("  ", " ").replace("\\\"", "\"")
 
-                available_servers = json.loads(api.cmd([api._config["dlna_command"], "list-servers"]))
-                server: str | None = None
+        extensionIndex = title.rfind(".")
+        if (extensionIndex >= 0 and not " " in title[extensionIndex + 1:]):
+            title = title[:extensionIndex]
 
-                for server in available_servers:
-                    if (server["path"].removeprefix("http://").split("/", 1)[0] == ip):
-                        server = server["path"]
-                        break
+        metadata["title"] = title.strip()
 
-                if (server is not None):
-                    data = json.loads(api.cmd([api._config["dlna_command"], "search", "-s", server, "-sq", url, "-st", "path"]))
-                    if (len(data) > 0):
-                        self.metadata["title"] = data[0]["name"]
-                        api.vlc_dlna_cache[url] = data[0]["name"]
+    def isTitleBlacklisted(self, api: MediaAPI) -> bool:
+        if (self.metadata["title"] is None):
+            return False
+        return api._config.isTitleBlacklisted(self.metadata["title"])
 
-        title: str = self.metadata["title"].removeprefix("\"").removesuffix("\"").replace("  ", " ").replace("\\\"", "\"")
+    def getReadableTitle(self, api: MediaAPI) -> str:
+        artists = self.metadata["artist"]
+        key = (self.metadata["title"], tuple(artists) if artists is not None else None, api._config.generation)
 
-        extensionIndex = title.lastIndexOf(".")
-        extension = title.slice(extensionIndex + 1)
-        if (not extension.includes(" ")):
-            title = title.slice(0, extensionIndex)
+        ret = api._readable_titles.get(key)
+        if (ret is not None):
+            api._readable_titles.move_to_end(key)
+            return ret
 
-        self.metadata["title"] = title.strip()
+        ret = Source._formatReadableTitle(api._config, self.metadata)
 
-    def isTitleBlacklisted(self, api: MediaAPI) -> bool:
-        if ("keyword_blacklist" in api._config):
-            lower_name = self.metadata["title"].lower()
-            for keyword in api._config["keyword_blacklist"]:
-                if (lower_name.includes(keyword.lower())):
-                    return True
-        return False
+        api._readable_titles[key] = ret
+        if (len(api._readable_titles) > api.TITLE_CACHE_SIZE):
+            api._readable_titles.popitem(last=False)
 
-    def getReadableTitle(self, api: MediaAPI) -> str:
-        ret = self.metadata["title"].replace("  ", " ")
+        return ret
+
+    @staticmethod
+    def _formatReadableTitle(config: MediaConfig, metadata: dict) -> str:
+        ret = metadata["title"].replace("  ", " ")
         
-        if ("title_replacements" in api._config and ret in api._config["title_replacements"]):
-            ret = api._config["title_replacements"][ret]
+        if (ret in config.title_replacements):
+            ret = config.title_replacements[ret]
         else:
-            if ("remove_brackets" in api._config):
-                ret = removeBrackets(ret, api._config["remove_brackets"])
+            if (config.remove_brackets is not None):
+                ret = removeBrackets(ret, config.remove_brackets)
 
-            if ("substring_replacements" in api._config):
-                for key in api._config["substring_replacements"]:
-                    ret = ret.replace(key, api._config["substring_replacements"][key])
+            ret = config.replaceSubstrings(ret)
 
-        if (self.metadata["artist"] is not None and len(self.metadata["artist"]) > 0):
-            artist = self.metadata["artist"][0].strip()
-            if "artist_replacements" in api._config and artist in api._config["artist_replacements"]:
-                artist = api._config["artist_replacements"][artist]
+        if (metadata["artist"] is not None and len(metadata["artist"]) > 0):
+            artist = metadata["artist"][0].strip()
+            artist = config.artist_replacements.get(artist, artist)
             ret = artist + "  |  " + ret
 
         return ret.strip()
 
+    # Artist and title filters, checked against the current metadata
+    def passesFilters(self, api: MediaAPI) -> bool:
+        if (self.metadata["artist"] is not None):
+            for artist in self.metadata["artist"]:
+                if (api._config.isArtistBlacklisted(artist)):
+                    return False
+
+        return not self.isTitleBlacklisted(api)
+
     @staticmethod
     def create(source_id: str, api: MediaAPI) -> Source | None:
 
         source: Source = Source(api, source_id)
         source.updateMetadata()
 
-        if ("artist_blacklist" in api._config and source.metadata["artist"] is not None):
-            for artist in source.metadata["artist"]:
-                for blacklisted_artist in api._config["artist_blacklist"]:
-                    if (MediaAPI.matchRuleShort(artist, blacklisted_artist)):
-                        return None
-
-        if (source.isTitleBlacklisted(api)):
+        if (not source.passesFilters(api)):
             return None
 
+        if (api.event_driven):
+            source.subscribe()
+
         return source
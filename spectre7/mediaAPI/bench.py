@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+# Benchmarks MediaAPI and its daemon against synthetic MPRIS players on a private session bus
+
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Thread
+from spectre7.stats import summarise
+
+"""
+
+Arguments:
+
+0: Mode [run (default), players]
+
+Flags (run):
+-n <count>: Amount of synthetic players (default 10)
+-t <count>: Update ticks measured per mode (default 200)
+-c <ms>: Interval between metadata changes of a random player, 0 to disable (default 50)
+-r <count>: Round trips measured per daemon command (default 200)
+-o <path>: Write results to a file instead of stdout
+
+Results are a single JSON object so that runs can be compared.
+
+"""
+
+def startBus() -> tuple[subprocess.Popen, str]:
+    process = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"], stdout=subprocess.PIPE, text=True)
+    address = process.stdout.readline().strip()
+    if not address:
+        process.kill()
+        raise RuntimeError("dbus-daemon did not print its address")
+    return process, address
+
+def getFreePort() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# Returns user + system CPU seconds used by a process
+def getProcessCpuTime(pid: int) -> float:
+    with open(f"/proc/{pid}/stat", "r") as f:
+        # The process name may contain spaces, fields are counted from after it
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def runPlayers(count: int, churn_ms: int):
+    from gi.repository import GLib
+    from spectre7.mprisserver import MprisServer, MprisPlayerInterface, MprisRuntime
+
+    class BenchPlayer(MprisPlayerInterface):
+        def __init__(self, index: int):
+            self.index = index
+            self.track = 0
+            self.status = random.choice(("Playing", "Paused"))
+            self.setTrack(notify=False)
+
+        @property
+        def PlaybackStatus(self) -> str:
+            return self.status
+
+        def setTrack(self, notify: bool = True):
+            self.setMetadata({
+                "mpris:trackid": f"/track/{self.track}",
+                "xesam:title": f"Track {self.track} (Official Video) [HD]",
+                "xesam:artist": [f"Artist {self.index}"],
+            }, notify=notify)
+
+        def churn(self):
+            self.track += 1
+            if random.random() < 0.2:
+                self.status = "Paused" if self.status == "Playing" else "Playing"
+            self.setTrack()
+            self.notifyPropertyChanged("PlaybackStatus")
+
+    # Every player shares the runtime's connection to the bus
+    runtime = MprisRuntime()
+    players: list[BenchPlayer] = []
+
+    for i in range(count):
+        player = BenchPlayer(i)
+        server = MprisServer(f"bench{i}")
+        server.setPlayerInterface(player)
+        runtime.publish(server)
+        players.append(player)
+
+    def churn() -> bool:
+        random.choice(players).churn()
+        return True
+
+    if churn_ms > 0 and len(players) > 0:
+        GLib.timeout_add(churn_ms, churn)
+
+    print("ready", flush=True)
+    runtime.run()
+
+def benchmarkUpdates(api, ticks: int, players_pid: int) -> dict:
+    durations: list[float] = []
+    calls: list[int] = []
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    players_cpu_start = getProcessCpuTime(players_pid)
+
+    for _ in range(ticks):
+        dbus_calls = api.dbus_calls
+        start = time.perf_counter()
+        api.update()
+        durations.append(time.perf_counter() - start)
+        calls.append(api.dbus_calls - dbus_calls)
+
+    wall = time.perf_counter() - wall_start
+
+    return {
+        "tick_seconds": summarise(durations),
+        "dbus_calls_per_tick": summarise(calls),
+        "cpu_per_second": (time.process_time() - cpu_start) / wall,
+        "players_cpu_per_second": (getProcessCpuTime(players_pid) - players_cpu_start) / wall,
+        "property_cache": {"hits": api.property_cache_hits, "misses": api.property_cache_misses},
+    }
+
+def benchmarkCommands(round_trips: int) -> dict:
+    from spectre7.mediaAPI import daemon
+
+    server = daemon.Server()
+    server.start(True)
+    Thread(target=server.listen, args=(True,), daemon=True).start()
+    time.sleep(0.5)
+
+    client = daemon.Client()
+    ret = {}
+
+    for command in ("getinfo", "playpause", "next"):
+        durations: list[float] = []
+        for _ in range(round_trips):
+            start = time.perf_counter()
+            client.execute(command)
+            durations.append(time.perf_counter() - start)
+        ret[command] = summarise(durations)
+
+    durations = []
+    for _ in range(round_trips):
+        start = time.perf_counter()
+        client.request("next", "getinfo")
+        durations.append(time.perf_counter() - start)
+    ret["next+getinfo"] = summarise(durations)
+
+    server.stop(True)
+    return ret
+
+def run(player_count: int, ticks: int, churn_ms: int, round_trips: int) -> dict:
+    bus_process, address = startBus()
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = address
+
+    players = subprocess.Popen([sys.executable, "-m", "spectre7.mediaAPI.bench", "players", str(player_count), str(churn_ms)], stdout=subprocess.PIPE, text=True)
+    config_dir = tempfile.TemporaryDirectory()
+
+    try:
+        if players.stdout.readline().strip() != "ready":
+            raise RuntimeError("Synthetic players failed to start")
+
+        from gi.repository import GLib
+        from pydbus import connect as DBusConnect
+        from spectre7.mediaAPI import MediaAPI
+        from spectre7.mediaAPI.volume import FakeVolumeBackend
+        from spectre7.mediaAPI import daemon
+
+        config_path = os.path.join(config_dir.name, "mediapanel-config.json")
+        with open(config_path, "w") as f:
+            json.dump({"remove_brackets": "()[]", "substring_replacements": {"Official": ""}}, f)
+        MediaAPI.getConfigPath = staticmethod(lambda: config_path)
+        # MediaAPI connects to the user's session bus on import
+        MediaAPI.bus = DBusConnect(address)
+        MediaAPI.volume_backend = FakeVolumeBackend()
+
+        daemon.REMOTE_PORT = getFreePort()
+        daemon.PUBLISH_PORT = getFreePort()
+
+        ret = {
+            "players": player_count,
+            "ticks": ticks,
+            "churn_ms": churn_ms,
+            "python": sys.version.split()[0],
+            "time": time.time(),
+        }
+
+        api = MediaAPI()
+        api.waybar_notifier = None
+        # Ticks run back to back, every one of them has to check the players to measure a full poll
+        api.POLL_INTERVAL = 0
+        ret["polling"] = benchmarkUpdates(api, ticks, players.pid)
+        api.close()
+
+        loop = GLib.MainLoop()
+        loop_thread = Thread(target=loop.run, daemon=True)
+        loop_thread.start()
+
+        api = MediaAPI()
+        api.waybar_notifier = None
+        api.enableEvents()
+        ret["events"] = benchmarkUpdates(api, ticks, players.pid)
+        api.disableEvents()
+        api.close()
+
+        ret["commands"] = benchmarkCommands(round_trips)
+
+        loop.quit()
+        return ret
+    finally:
+        players.kill()
+        bus_process.kill()
+        config_dir.cleanup()
+
+def main():
+    args = sys.argv[1:]
+    mode = "run"
+
+    if len(args) > 0 and not args[0].startswith("-"):
+        mode = args.pop(0).lower().strip()
+
+    if mode == "players":
+        runPlayers(int(args[0]), int(args[1]))
+        return
+
+    if mode != "run":
+        print(f"Unknown mode '{mode}'\nAvailable modes:\n - run (default)\n - players")
+        return
+
+    options = {"-n": 10, "-t": 200, "-c": 50, "-r": 200}
+    output_path: str | None = None
+
+    i = 0
+    while i < len(args):
+        if args[i] in options:
+            options[args[i]] = int(args[i + 1])
+        elif args[i] == "-o":
+            output_path = args[i + 1]
+        else:
+            print(f"Unknown flag '{args[i]}'")
+            return
+        i += 2
+
+    results = run(options["-n"], options["-t"], options["-c"], options["-r"])
+
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import fnmatch
+import itertools
+import re
+
+_generations = itertools.count(1)
+
+def _compileGlobs(patterns: list[str]) -> re.Pattern | None:
+    if (len(patterns) == 0):
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns))
+
+# Longest first, so that a keyword which contains another one takes priority at the same position
+def _compileAlternation(strings: list[str], flags: int = 0) -> re.Pattern | None:
+    strings = [string for string in strings if len(string) > 0]
+    if (len(strings) == 0):
+        return None
+    return re.compile("|".join(re.escape(string) for string in sorted(strings, key=len, reverse=True)), flags)
+
+# Precompiled form of the mediapanel config file.
+# Instances are never modified after construction, a reload creates a new one with a higher generation.
+class MediaConfig:
+
+    def __init__(self, data: dict):
+        self.data: dict = data
+        self.generation: int = next(_generations)
+
+        self.dlna_command: str | None = data.get("dlna_command")
+        self.remove_brackets: str | None = data.get("remove_brackets")
+        self.title_replacements: dict[str, str] = dict(data.get("title_replacements", {}))
+        self.artist_replacements: dict[str, str] = dict(data.get("artist_replacements", {}))
+
+        self._source_blacklist = _compileGlobs(data.get("source_blacklist", []))
+        self._artist_blacklist = _compileGlobs(data.get("artist_blacklist", []))
+        self._keyword_blacklist = _compileAlternation([keyword.lower() for keyword in data.get("keyword_blacklist", [])])
+
+        self._substring_replacements: dict[str, str] = dict(data.get("substring_replacements", {}))
+        self._substring_pattern = _compileAlternation(list(self._substring_replacements))
+
+    def isSourceBlacklisted(self, source_id: str) -> bool:
+        return self._source_blacklist is not None and self._source_blacklist.match(source_id) is not None
+
+    def isArtistBlacklisted(self, artist: str) -> bool:
+        return self._artist_blacklist is not None and self._artist_blacklist.match(artist) is not None
+
+    def isTitleBlacklisted(self, title: str) -> bool:
+        return self._keyword_blacklist is not None and self._keyword_blacklist.search(title.lower()) is not None
+
+    # Replaces all configured substrings in a single pass over the text
+    def replaceSubstrings(self, text: str) -> str:
+        if (self._substring_pattern is None):
+            return text
+        return self._substring_pattern.sub(lambda match: self._substring_replacements[match.group(0)], text)
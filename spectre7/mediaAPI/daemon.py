@@ -1,14 +1,21 @@
 #!/usr/bin/python3
 
-from zmq import Context, REQ, REP, error
-from threading import Thread
+from zmq import Context, Poller, REQ, ROUTER, PUB, SUB, PUSH, PULL, POLLIN, SUBSCRIBE, error
+from threading import Thread, Event, Lock, local
+from time import perf_counter, monotonic
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 from os import system
-from time import sleep
 import json
 from spectre7 import utils
 import notify2
+from gi.repository import GLib
 
 from spectre7.mediaAPI import MediaAPI
+from spectre7.mediaAPI import protocol, metrics
+from spectre7.mediaAPI.scheduler import UpdateScheduler
+from spectre7.mediaAPI.export import RecordExporter
+from spectre7.mediaAPI.protocol import CommandError, ErrorCode
 
 """
 
@@ -19,20 +26,41 @@ Arguments:
 Flags:
 -s: Start MediaAPI on startup if in server mode
 -n: Send system notification on server startup
+-p: Poll for media players instead of subscribing to D-Bus signals
+-m: Collect metrics, which are returned by the stats command
+-f <path>: Collect metrics and periodically write them to a file in the Prometheus text format
+-e <target>: Append a JSON line for every track change of the current source to a file, or to a socket given as unix:<path> or tcp:<host>:<port>
 
 """
 
 APP_NAME = "MediaAPI"
 REMOTE_PORT = 3000
+# State changes are published as {"seq": int, "changes": dict} on this port
+PUBLISH_PORT = REMOTE_PORT + 1
 CONNECTION_TIMEOUT = 1000
+RESULTS_ADDRESS = "inproc://mediaapi-results"
+
+STATE_FIELDS = ("visible", "can_go_next", "can_go_previous", "title", "volume", "muted", "playing", "source", "metadata")
 
 class Server:
 
-    UPDATE_INTERVAL = 2
+    # Threads running client commands
+    WORKER_COUNT = 4
+    # Seconds between writes of the Prometheus metrics file
+    METRICS_WRITE_INTERVAL = 10
+
+    metrics_path: str | None = None
+    # Passed to RecordExporter.open() when MediaAPI starts
+    export_target: str | None = None
 
     api: MediaAPI = None
     thread: Thread = None
 
+    event_driven: bool = True
+    loop: GLib.MainLoop = None
+    loop_thread: Thread = None
+    scheduler: UpdateScheduler = None
+
     visible: bool = False
     can_go_next: bool = False
     can_go_previous: bool = False
@@ -40,12 +68,47 @@ class Server:
     volume: int = 0
     muted: bool = False
     playing: bool = False
+    # ID and metadata of the current source
+    source: str | None = None
+    metadata: dict | None = None
+
+    # Incremented for every published state change
+    seq: int = 0
+    state_lock: Lock = Lock()
+    publish_queue: Queue | None = None
+
+    # Held by commands which start or stop MediaAPI
+    lifecycle_lock: Lock = Lock()
+
+    def _setState(self, **fields):
+        with self.state_lock:
+            changes = {key: value for key, value in fields.items() if getattr(self, key) != value}
+            if len(changes) == 0:
+                return
+
+            for key, value in changes.items():
+                setattr(self, key, value)
+
+            self.seq += 1
+            if self.publish_queue is not None:
+                self.publish_queue.put(json.dumps({"seq": self.seq, "changes": changes}))
+
+    def publishThread(self, context: Context):
+        socket = context.socket(PUB)
+        socket.bind(f"tcp://127.0.0.1:{PUBLISH_PORT}")
+
+        while True:
+            message = self.publish_queue.get()
+            if message is None:
+                break
+            socket.send_string(message)
+
+        socket.close(0)
 
     def listen(self, silent: bool = False, notify: bool = False):
 
         context = Context()
-        socket = context.socket(REP)
-        socket.RCVTIMEO = CONNECTION_TIMEOUT
+        socket = context.socket(ROUTER)
 
         try:
             socket.bind(f"tcp://127.0.0.1:{REMOTE_PORT}")
@@ -54,6 +117,14 @@ class Server:
                 self.stop()
             raise e
 
+        self.publish_queue = Queue()
+        publish_thread = Thread(target=self.publishThread, args=(context,), daemon=True)
+        publish_thread.start()
+
+        metrics_stop = Event()
+        if self.metrics_path is not None:
+            Thread(target=self.metricsThread, args=(metrics_stop,), daemon=True).start()
+
         utils.log(f"Running in remote server mode at 127.0.0.1:{REMOTE_PORT}")
 
         if notify:
@@ -62,53 +133,179 @@ class Server:
             notification.timeout = 2000
             notification.show()
 
+        # Workers send finished responses back to this thread, which owns the ROUTER socket
+        results = context.socket(PULL)
+        results.bind(RESULTS_ADDRESS)
+        worker_sockets = local()
+
+        def respond(envelope: list[bytes], response: bytes):
+            push = getattr(worker_sockets, "socket", None)
+            if push is None:
+                push = worker_sockets.socket = context.socket(PUSH)
+                push.connect(RESULTS_ADDRESS)
+            push.send_multipart(envelope + [response])
+
+        # Runs on the executor, which drops exceptions, so every request is answered even if handling it failed
+        def handle(envelope: list[bytes], data: bytes):
+            structured = protocol.isStructured(data)
+            try:
+                if structured:
+                    response = self.runRequest(data, silent)
+                else:
+                    inp = data.decode("utf8").lower().strip()
+                    try:
+                        response = self.runCommand(inp, silent).encode("utf8")
+                    except Exception as e:
+                        response = utils.format_colour("red", f"'{inp}' failed: {e}").encode("utf8")
+            except Exception as e:
+                if structured:
+                    response = protocol.encodeResponse(None, error=CommandError(ErrorCode.INTERNAL_ERROR, f"Request failed: {e}"))
+                else:
+                    response = utils.format_colour("red", f"Request failed: {e}").encode("utf8")
+
+            respond(envelope, response)
+
+        executor = ThreadPoolExecutor(self.WORKER_COUNT, thread_name_prefix="mediaapi-command")
+
+        poller = Poller()
+        poller.register(socket, POLLIN)
+        poller.register(results, POLLIN)
+
         try:
             while True:
-                try:
-                    inp = socket.recv().decode("utf8").lower().strip()
-                except error.Again:
-                    continue
+                events = dict(poller.poll())
 
-                response = ""
-                
-                if inp in self.COMMANDS:
-                    response = self.COMMANDS[inp](self, silent)
-                elif inp == "help":
-                    msg = "Available commands:"
-                    for command in self.COMMANDS:
-                        msg += f" - {command}\n"
-                    response = msg.rstrip()
-                elif inp != "":
-                    response = utils.format_colour("red", f"'{inp}' is not a valid command")
-                
-                socket.send_string(response)
+                if socket in events:
+                    frames = socket.recv_multipart()
+
+                    # Routing frames up to and including the empty delimiter added by REQ sockets
+                    delimiter = frames.index(b"") if b"" in frames else len(frames) - 2
+                    envelope = frames[:delimiter + 1]
+
+                    executor.submit(handle, envelope, frames[-1])
+
+                if results in events:
+                    socket.send_multipart(results.recv_multipart())
 
         except KeyboardInterrupt:
             print("")
 
+        executor.shutdown(wait=False, cancel_futures=True)
+        metrics_stop.set()
+
+        self.publish_queue.put(None)
+        publish_thread.join()
+        self.publish_queue = None
+
         context.destroy()
 
+    # Runs a command and returns its result, raising CommandError on failure
+    def executeCommand(self, command: str, silent: bool = False):
+        command = command.lower().strip()
+        if not command in self.COMMANDS:
+            raise CommandError(ErrorCode.UNKNOWN_COMMAND, f"'{command}' is not a valid command")
+
+        try:
+            return self.COMMANDS[command](self, silent)
+        except CommandError:
+            raise
+        except Exception as e:
+            raise CommandError(ErrorCode.INTERNAL_ERROR, f"'{command}' failed: {e}")
+
+    # Handles a structured protocol request and returns the encoded response
+    def runRequest(self, data: bytes, silent: bool = False) -> bytes:
+        try:
+            request_id, commands = protocol.decodeRequest(data)
+        except CommandError as e:
+            return protocol.encodeResponse(e.request_id, error=e)
+
+        results = []
+        for command in commands:
+            try:
+                results.append(protocol.successResult(self.executeCommand(command, silent)))
+            except CommandError as e:
+                results.append(protocol.errorResult(e))
+
+        return protocol.encodeResponse(request_id, results)
+
+    # Text protocol, kept for compatibility with older clients
+    def runCommand(self, inp: str, silent: bool = False) -> str:
+        if inp == "help":
+            msg = "Available commands:"
+            for command in self.COMMANDS:
+                msg += f" - {command}\n"
+            return msg.rstrip()
+        elif inp == "":
+            return ""
+
+        try:
+            result = self.executeCommand(inp, silent)
+        except CommandError as e:
+            return utils.format_colour("red", e.message)
+
+        if isinstance(result, str):
+            return result
+        return json.dumps(result)
+
+    def _requireApi(self, silent: bool) -> MediaAPI:
+        api = self.api
+        if not api:
+            msg = f"{APP_NAME} is not running"
+            if not silent:
+                utils.err(msg)
+            raise CommandError(ErrorCode.NOT_RUNNING, msg)
+        return api
+
     def updateThread(self):
+        last_resync = monotonic()
+
         while self.api:
-            self.api.update()
-            sleep(self.UPDATE_INTERVAL)
+            api = self.api
+
+            if metrics.enabled:
+                start = perf_counter()
+                api.update()
+                metrics.observe("tick_seconds", perf_counter() - start)
+            else:
+                api.update()
+
+            self.scheduler.wait(api)
+
+            if api.event_driven and self.api and monotonic() - last_resync >= self.scheduler.EVENT_FALLBACK_INTERVAL:
+                api.resyncSources()
+                last_resync = monotonic()
+
+    def metricsThread(self, stop: Event):
+        while not stop.wait(self.METRICS_WRITE_INTERVAL):
+            try:
+                metrics.writePrometheus(self.metrics_path)
+            except OSError as e:
+                utils.warn(f"Could not write metrics to '{self.metrics_path}' ({e})")
+
+    def wake(self):
+        self.scheduler.wake()
 
     def setVisibleCallback(self, visible: bool):
-        self.visible = visible
+        self._setState(visible=visible)
     def setCanGoNextCallback(self, can_go: bool):
-        self.can_go_next = can_go
+        self._setState(can_go_next=can_go)
     def setCanGoPreviousCallback(self, can_go: bool):
-        self.can_go_previous = can_go
+        self._setState(can_go_previous=can_go)
     def setTitleCallback(self, title: str):
-        self.title = title
+        self._setState(title=title)
     def setVolumeCallback(self, volume: int, muted: bool):
-        self.volume = volume
-        self.muted = muted
+        self._setState(volume=volume, muted=muted)
     def setPlayingCallback(self, playing: bool):
-        self.playing = playing;
+        self._setState(playing=playing)
+    def setTrackCallback(self, source: str | None, metadata: dict | None):
+        self._setState(source=source, metadata=metadata)
     
     # Start MediaAPI if not running
     def start(self, silent: bool = False) -> str:
+        with self.lifecycle_lock:
+            return self._start(silent)
+
+    def _start(self, silent: bool = False) -> str:
         if self.api:
             msg = f"{APP_NAME} is already running"
             if silent:
@@ -121,9 +318,32 @@ class Server:
         self.api.setCanGoNextCallback = self.setCanGoNextCallback
         self.api.setCanGoPreviousCallback = self.setCanGoPreviousCallback
         self.api.setTitleCallback = self.setTitleCallback
-        # TODO
-        # self.api.setVolumeCallback = self.setVolumeCallback
+        self.api.setVolumeCallback = self.setVolumeCallback
         self.api.setPlayingCallback = self.setPlayingCallback
+        self.api.setTrackCallback = self.setTrackCallback
+        self.api.wakeCallback = self.wake
+        self.scheduler = UpdateScheduler()
+
+        if self.export_target is not None:
+            try:
+                self.api.track_exporter = RecordExporter.open(self.export_target)
+            except (OSError, ValueError) as e:
+                utils.warn(f"Could not export track changes to '{self.export_target}' ({e})")
+
+        try:
+            self.api.watchConfig()
+        except OSError as e:
+            utils.warn(f"Could not watch the config file, use reloadconfig after editing it ({e})")
+
+        if self.event_driven:
+            try:
+                self.api.enableEvents()
+            except Exception as e:
+                utils.warn(f"Could not subscribe to D-Bus signals, falling back to polling ({e})")
+            else:
+                self.loop = GLib.MainLoop()
+                self.loop_thread = Thread(target=self.loop.run, daemon=True)
+                self.loop_thread.start()
 
         self.thread = Thread(target=self.updateThread)
         self.thread.start()
@@ -135,15 +355,30 @@ class Server:
 
     # Stop MediaAPI if running
     def stop(self, silent: bool = False) -> str:
+        with self.lifecycle_lock:
+            return self._stop(silent)
+
+    def _stop(self, silent: bool = False) -> str:
         if self.api is None:
             msg = f"{APP_NAME} is not running"
             if not silent:
                 utils.log(msg)
             return msg
         
+        api = self.api
         self.api = None
+        self.scheduler.stop()
         self.thread.join()
 
+        api.disableEvents()
+        api.close()
+        self._setState(source=None, metadata=None)
+        if self.loop:
+            self.loop.quit()
+            self.loop_thread.join()
+            self.loop = None
+            self.loop_thread = None
+
         msg = f"{APP_NAME} stopped"
         if not silent:
             utils.log(msg)
@@ -151,75 +386,67 @@ class Server:
 
     # Restart MediaAPI (starts if not running)
     def restart(self, silent: bool = False) -> str:
-        if self.api:
-            self.stopAPI(silent)
-        return self.startAPI(silent)
+        with self.lifecycle_lock:
+            if self.api:
+                self._stop(silent)
+            return self._start(silent)
 
-    def getInfo(self, silent: bool = False) -> str:
-        info = {property: getattr(self, property) for property in ("visible", "can_go_next", "can_go_previous", "title", "volume", "muted", "playing")}
-        
-        info["metadata"] = self.api.current_source.metadata if self.api.current_source is not None else None
-        info["source"] = self.api.current_source.id if self.api.current_source is not None else None
+    def getInfo(self, silent: bool = False) -> dict:
+        with self.state_lock:
+            info = {property: getattr(self, property) for property in STATE_FIELDS}
+            info["seq"] = self.seq
 
-        msg = json.dumps(info)
         if not silent:
-            print(msg)
-        return msg
+            print(json.dumps(info))
+        return info
 
     def reloadConfig(self, silent: bool = False) -> str:
-        if not self.api:
-            msg = f"{APP_NAME} is not running"
-            if not silent:
-                utils.err(msg)
-            return msg
-        
-        msg = ""
+        api = self._requireApi(silent)
 
-        def calllback(_msg: str):
-            nonlocal msg
-            msg = _msg
+        try:
+            api.loadConfig()
+        except Exception as e:
+            if not silent:
+                utils.err(e)
+            raise CommandError(ErrorCode.CONFIG_ERROR, str(e))
 
-        self.api.loadConfig(calllback)
-        
+        msg = f"Config file at '{api.getConfigPath()}' loaded successfully"
         if not silent:
             utils.log(msg)
-        
         return msg
 
+    # Every tracked source, including ones which are filtered out
+    def getSources(self, silent: bool = False) -> list[dict]:
+        sources = self._requireApi(silent).getSnapshot()
+        if not silent:
+            print(json.dumps(sources))
+        return sources
+
+    def stats(self, silent: bool = False) -> dict:
+        ret = metrics.snapshot()
+
+        api = self.api
+        if api:
+            ret["dbus_calls"] = api.dbus_calls
+            ret["property_cache"] = api.getPropertyCacheStats()
+
+        if not silent:
+            print(json.dumps(ret, indent=2))
+        return ret
+
     def playPause(self, silent: bool = False) -> str:
-        if not self.api:
-            msg = f"{APP_NAME} is not running"
-            if not silent:
-                utils.err(msg)
-            return msg
-        
-        self.api.mediaPlayPause()
-        
+        self._requireApi(silent).mediaPlayPause()
         return ""
-    
+
     def next(self, silent: bool = False) -> str:
-        if not self.api:
-            msg = f"{APP_NAME} is not running"
-            if not silent:
-                utils.err(msg)
-            return msg
-        
-        self.api.mediaForward()
-        
+        self._requireApi(silent).mediaForward()
         return ""
 
     def previous(self, silent: bool = False) -> str:
-        if not self.api:
-            msg = f"{APP_NAME} is not running"
-            if not silent:
-                utils.err(msg)
-            return msg
-        
-        self.api.mediaBackward()
-        
+        self._requireApi(silent).mediaBackward()
         return ""
 
-    COMMANDS = {method.__name__.lower(): method for method in (start, stop, restart, getInfo, reloadConfig, playPause, next, previous)}
+    COMMANDS = {method.__name__.lower(): method for method in (start, stop, restart, getInfo, getSources, reloadConfig, stats, playPause, next, previous)}
 
 class Client:
 
@@ -228,6 +455,7 @@ class Client:
         self.socket = self.context.socket(REQ)
         self.socket.connect(f"tcp://127.0.0.1:{REMOTE_PORT}")
         self.socket.RCVTIMEO = CONNECTION_TIMEOUT
+        self.request_id = 0
 
     def __delete__(self):
         self.context.destroy()
@@ -253,6 +481,60 @@ class Client:
             print(response)
         return response
 
+    # Sends several commands in one round trip using the structured protocol.
+    # Returns a result dict ({"ok": True, "result": ...} or {"ok": False, "error": {...}}) for each command.
+    def request(self, *commands: str) -> list[dict]:
+        self.request_id += 1
+        self.socket.send(protocol.encodeRequest(self.request_id, list(commands)))
+
+        try:
+            response = self.socket.recv()
+        except error.Again:
+            # A REQ socket can't send again until it received a reply, so start over with a new one
+            self.socket.close(0)
+            self.socket = self.context.socket(REQ)
+            self.socket.connect(f"tcp://127.0.0.1:{REMOTE_PORT}")
+            self.socket.RCVTIMEO = CONNECTION_TIMEOUT
+            raise CommandError(ErrorCode.TIMEOUT, f"Timed out after {CONNECTION_TIMEOUT}ms")
+
+        return protocol.decodeResponse(response, self.request_id)
+
+    # Runs a single command with the structured protocol and returns its result, raising CommandError on failure
+    def execute(self, command: str):
+        result = self.request(command)[0]
+        if not result["ok"]:
+            raise CommandError.fromDict(result["error"])
+        return result["result"]
+
+    # Yields the full server state, then again after each published change.
+    # Missed changes are detected through the sequence number and recovered by requesting the state again.
+    def subscribe(self):
+        socket = self.context.socket(SUB)
+        socket.setsockopt_string(SUBSCRIBE, "")
+        socket.connect(f"tcp://127.0.0.1:{PUBLISH_PORT}")
+
+        try:
+            state: dict = self.execute("getinfo")
+            yield dict(state)
+
+            while True:
+                message = json.loads(socket.recv())
+
+                if message["seq"] <= state["seq"]:
+                    continue
+
+                if message["seq"] != state["seq"] + 1:
+                    state = self.execute("getinfo")
+                    if message["seq"] != state["seq"] + 1:
+                        yield dict(state)
+                        continue
+
+                state.update(message["changes"])
+                state["seq"] = message["seq"]
+                yield dict(state)
+        finally:
+            socket.close(0)
+
     def runInteractive(self):
         try:
             while True:
@@ -278,6 +560,9 @@ def main():
     mode = "client"
     autostart = False
     notify = False
+    poll = False
+    metrics_path = None
+    export_target = None
 
     if len(args) > 0:
         mode = args.pop(0).lower().strip()
@@ -289,6 +574,15 @@ def main():
                 autostart = True
             elif arg == "-n":
                 notify = True
+            elif arg == "-p":
+                poll = True
+            elif arg == "-m":
+                metrics.enable()
+            elif arg == "-f" and i + 1 < len(args):
+                metrics.enable()
+                metrics_path = args.pop(i + 1)
+            elif arg == "-e" and i + 1 < len(args):
+                export_target = args.pop(i + 1)
             else:
                 i += 1
                 continue
@@ -297,6 +591,9 @@ def main():
 
     if mode == "server":
         server = Server()
+        server.event_driven = not poll
+        server.metrics_path = metrics_path
+        server.export_target = export_target
         if autostart:
             server.start()
         server.listen(True, notify)
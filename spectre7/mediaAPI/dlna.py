@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from queue import Queue
+from subprocess import check_output
+from threading import Thread, Lock
+from typing import Callable
+from spectre7 import utils
+from spectre7.mediaAPI import metrics
+
+def getDefaultCachePath() -> str:
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "mediapanel", "dlna-cache.sqlite")
+
+# Disk-backed cache of DLNA stream URL -> title.
+# Titles which are not cached are resolved with `command` on a background thread, so get() never waits on the server.
+class DlnaTitleCache:
+
+    # Entries on disk, least recently used ones are evicted first
+    MAX_ENTRIES = 2000
+    # Seconds after which a stored title is resolved again
+    TTL = 30 * 24 * 60 * 60
+    # Seconds for which the server list of each IP is reused
+    SERVER_TTL = 5 * 60
+    # Entries kept in memory in front of the database
+    MEMORY_ENTRIES = 64
+    # Seconds before a URL which couldn't be resolved is tried again
+    FAILURE_TTL = 60
+
+    cmd = staticmethod(check_output)
+
+    def __init__(self, command: str, path: str | None = None, on_resolved: Callable[[str, str], None] | None = None):
+        self.command = command
+        self.path = path or getDefaultCachePath()
+        self.on_resolved = on_resolved
+
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._servers: dict[str, tuple[float, str | None]] = {}
+        self._pending: set[str] = set()
+        # URL -> time.monotonic() of its last failed lookup
+        self._failed: dict[str, float] = {}
+        self._queue: Queue = Queue()
+        self._lock = Lock()
+        self._closed = False
+
+        if (self.path != ":memory:"):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS titles (url TEXT PRIMARY KEY, title TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)")
+        self._db.commit()
+
+        self._thread = Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    # Returns the cached title of `url`, or None after queueing it to be resolved unless `resolve` is False
+    def get(self, url: str, resolve: bool = True) -> str | None:
+        with self._lock:
+            if (self._closed):
+                return None
+
+            title = self._memory.get(url)
+            if (title is not None):
+                self._memory.move_to_end(url)
+                return title
+
+            now = time.time()
+            row = self._db.execute("SELECT title FROM titles WHERE url = ? AND created > ?", (url, now - self.TTL)).fetchone()
+            if (row is not None):
+                self._db.execute("UPDATE titles SET last_used = ? WHERE url = ?", (now, url))
+                self._db.commit()
+                self._remember(url, row[0])
+                return row[0]
+
+            failed = self._failed.get(url)
+            if (failed is not None and time.monotonic() - failed < self.FAILURE_TTL):
+                return None
+
+            if (resolve and not url in self._pending):
+                self._pending.add(url)
+                self._queue.put(url)
+
+        return None
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._db.close()
+
+    def _remember(self, url: str, title: str):
+        self._memory[url] = title
+        if (len(self._memory) > self.MEMORY_ENTRIES):
+            self._memory.popitem(last=False)
+
+    def _store(self, url: str, title: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?)", (url, title, now, now))
+            self._db.execute("DELETE FROM titles WHERE created <= ?", (now - self.TTL,))
+            self._db.execute("DELETE FROM titles WHERE url NOT IN (SELECT url FROM titles ORDER BY last_used DESC LIMIT ?)", (self.MAX_ENTRIES,))
+            self._db.commit()
+            self._remember(url, title)
+
+    def _getServer(self, ip: str) -> str | None:
+        cached = self._servers.get(ip)
+        if (cached is not None and time.monotonic() - cached[0] < self.SERVER_TTL):
+            return cached[1]
+
+        server: str | None = None
+        metrics.count("subprocess_spawns")
+        for available_server in json.loads(self.cmd([self.command, "list-servers"])):
+            if (available_server["path"].removeprefix("http://").split("/", 1)[0] == ip):
+                server = available_server["path"]
+                break
+
+        self._servers[ip] = (time.monotonic(), server)
+        return server
+
+    def _resolve(self, url: str) -> str | None:
+        if (not url.startswith("http://")):
+            return None
+
+        server = self._getServer(url.removeprefix("http://").split("/", 1)[0])
+        if (server is None):
+            return None
+
+        metrics.count("subprocess_spawns")
+        data = json.loads(self.cmd([self.command, "search", "-s", server, "-sq", url, "-st", "path"]))
+        if (len(data) == 0):
+            return None
+        return data[0]["name"]
+
+    def _worker(self):
+        while True:
+            url = self._queue.get()
+            if (url is None):
+                return
+
+            try:
+                title = self._resolve(url)
+            except Exception as e:
+                utils.warn(f"Could not resolve DLNA title of '{url}' ({e})")
+                title = None
+
+            with self._lock:
+                self._pending.discard(url)
+                if (title is None):
+                    now = time.monotonic()
+                    self._failed = {key: failed for key, failed in self._failed.items() if now - failed < self.FAILURE_TTL}
+                    self._failed[url] = now
+                else:
+                    self._failed.pop(url, None)
+
+            if (title is not None):
+                self._store(url, title)
+                if (self.on_resolved):
+                    self.on_resolved(url, title)
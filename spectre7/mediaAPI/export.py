@@ -0,0 +1,58 @@
+import json
+import socket
+from queue import Queue
+from threading import Thread
+from typing import TextIO
+from spectre7 import utils
+
+# Writes records as newline-delimited JSON to a stream, on a background thread so that a slow reader never delays updates.
+# Records which can't be written are dropped with a warning.
+class RecordExporter:
+
+    def __init__(self, stream: TextIO, close_stream: bool = True):
+        self.stream = stream
+        self.close_stream = close_stream
+
+        self._queue: Queue = Queue()
+        self._thread = Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    # Opens a file path for appending, or connects to "unix:<path>" or "tcp:<host>:<port>"
+    @staticmethod
+    def open(target: str) -> "RecordExporter":
+        if target.startswith("unix:"):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(target.removeprefix("unix:"))
+        elif target.startswith("tcp:"):
+            host, port = target.removeprefix("tcp:").rsplit(":", 1)
+            connection = socket.create_connection((host, int(port)))
+        else:
+            return RecordExporter(open(target, "a", encoding="utf-8"))
+
+        stream = connection.makefile("w", encoding="utf-8")
+        # The connection stays open until the stream is closed
+        connection.close()
+        return RecordExporter(stream)
+
+    def write(self, record: dict):
+        self._queue.put(json.dumps(record, separators=(",", ":"), default=str))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self.close_stream:
+            self.stream.close()
+
+    def _worker(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                return
+
+            try:
+                self.stream.write(line + "\n")
+                # Batch records which were queued together into one flush
+                if self._queue.empty():
+                    self.stream.flush()
+            except (OSError, ValueError) as e:
+                utils.warn(f"Could not export record ({e})")
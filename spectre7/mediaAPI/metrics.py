@@ -0,0 +1,149 @@
+import os
+import time
+from threading import Lock
+
+"""
+
+Process-wide instrumentation of MediaAPI. Collection is off until enable() is called,
+in which case every function returns immediately so that call sites can stay in hot paths.
+
+"""
+
+HISTOGRAM_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+enabled: bool = False
+
+_lock = Lock()
+_counters: dict[str, int] = {}
+_timers: dict[str, list] = {} # name -> [count, total, max]
+_histograms: dict[str, list] = {} # name -> [bucket counts..., +Inf count, sum]
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        addTime(self.name, time.perf_counter() - self.start)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _histograms.clear()
+
+def count(name: str, amount: int = 1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+# Context manager measuring the time spent inside it
+def timer(name: str):
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+def addTime(name: str, seconds: float):
+    if not enabled:
+        return
+    with _lock:
+        entry = _timers.get(name)
+        if entry is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+def observe(name: str, seconds: float):
+    if not enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [0] * (len(HISTOGRAM_BUCKETS) + 2)
+
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(HISTOGRAM_BUCKETS)] += 1
+        histogram[-1] += seconds
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "enabled": enabled,
+            "counters": dict(_counters),
+            "timers": {name: {"count": entry[0], "total": entry[1], "max": entry[2]} for name, entry in _timers.items()},
+            "histograms": {
+                name: {
+                    "buckets": {str(bound): histogram[i] for i, bound in enumerate(HISTOGRAM_BUCKETS)} | {"+Inf": histogram[len(HISTOGRAM_BUCKETS)]},
+                    "count": sum(histogram[:-1]),
+                    "sum": histogram[-1],
+                }
+                for name, histogram in _histograms.items()
+            },
+        }
+
+# Renders the collected metrics in the Prometheus text exposition format
+def toPrometheus(prefix: str = "mediaapi") -> str:
+    lines: list[str] = []
+
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+
+        if len(_timers) > 0:
+            lines.append(f"# TYPE {prefix}_section_seconds summary")
+            for name, entry in sorted(_timers.items()):
+                lines.append(f"{prefix}_section_seconds_count{{section=\"{name}\"}} {entry[0]}")
+                lines.append(f"{prefix}_section_seconds_sum{{section=\"{name}\"}} {entry[1]}")
+
+        for name, histogram in sorted(_histograms.items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            cumulative = 0
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                cumulative += histogram[i]
+                lines.append(f"{prefix}_{name}_bucket{{le=\"{bound}\"}} {cumulative}")
+            cumulative += histogram[len(HISTOGRAM_BUCKETS)]
+            lines.append(f"{prefix}_{name}_bucket{{le=\"+Inf\"}} {cumulative}")
+            lines.append(f"{prefix}_{name}_count {cumulative}")
+            lines.append(f"{prefix}_{name}_sum {histogram[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+# Replaces the file at `path` with the current metrics, so that readers never see a partial file
+def writePrometheus(path: str):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write(toPrometheus())
+    os.replace(temp_path, path)
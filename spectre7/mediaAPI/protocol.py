@@ -0,0 +1,99 @@
+import json
+
+"""
+
+Structured request/response protocol of the MediaAPI daemon.
+Messages are JSON objects, anything else sent to the server is handled as a plain text command.
+
+Request:  {"v": 1, "id": <int>, "commands": ["next", "getinfo"]}
+Response: {"v": 1, "id": <int>, "results": [{"ok": true, "result": ...}, {"ok": false, "error": {"code": "...", "message": "..."}}]}
+
+Commands of a request are run in order and each gets its own result.
+A request which can't be parsed gets a response with an "error" instead of "results".
+
+"""
+
+PROTOCOL_VERSION = 1
+
+class ErrorCode:
+    BAD_REQUEST = "bad_request"
+    UNSUPPORTED_VERSION = "unsupported_version"
+    UNKNOWN_COMMAND = "unknown_command"
+    NOT_RUNNING = "not_running"
+    CONFIG_ERROR = "config_error"
+    INTERNAL_ERROR = "internal_error"
+    TIMEOUT = "timeout"
+
+class CommandError(Exception):
+    # `request_id` is set when a request is rejected after its ID was read, so that the response can carry it
+    def __init__(self, code: str, message: str, request_id: int | None = None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.request_id = request_id
+
+    def toDict(self) -> dict:
+        return {"code": self.code, "message": self.message}
+
+    @staticmethod
+    def fromDict(data: dict) -> "CommandError":
+        return CommandError(data["code"], data["message"])
+
+def isStructured(data: bytes) -> bool:
+    return data[:1] == b"{"
+
+def encodeRequest(request_id: int, commands: list[str]) -> bytes:
+    return json.dumps({"v": PROTOCOL_VERSION, "id": request_id, "commands": commands}).encode("utf8")
+
+# Returns (id, commands), raising CommandError if the request is invalid
+def decodeRequest(data: bytes) -> tuple[int | None, list[str]]:
+    try:
+        request = json.loads(data)
+    except ValueError as e:
+        raise CommandError(ErrorCode.BAD_REQUEST, f"Invalid JSON: {e}")
+
+    if not isinstance(request, dict):
+        raise CommandError(ErrorCode.BAD_REQUEST, "Request must be an object")
+
+    request_id = request.get("id")
+
+    if request.get("v") != PROTOCOL_VERSION:
+        raise CommandError(ErrorCode.UNSUPPORTED_VERSION, f"Unsupported protocol version {request.get('v')}, expected {PROTOCOL_VERSION}", request_id)
+
+    commands = request.get("commands")
+    if not isinstance(commands, list) or not all(isinstance(command, str) for command in commands):
+        raise CommandError(ErrorCode.BAD_REQUEST, "'commands' must be a list of strings", request_id)
+
+    return request_id, commands
+
+def encodeResponse(request_id: int | None, results: list | None = None, error: CommandError | None = None) -> bytes:
+    response = {"v": PROTOCOL_VERSION, "id": request_id}
+    if error is not None:
+        response["error"] = error.toDict()
+    else:
+        response["results"] = results
+    return json.dumps(response).encode("utf8")
+
+def successResult(result) -> dict:
+    return {"ok": True, "result": result}
+
+def errorResult(error: CommandError) -> dict:
+    return {"ok": False, "error": error.toDict()}
+
+# Returns the results of a response, raising CommandError if the whole request failed
+def decodeResponse(data: bytes, request_id: int | None = None) -> list[dict]:
+    response = json.loads(data)
+
+    if response.get("v") != PROTOCOL_VERSION:
+        raise CommandError(ErrorCode.UNSUPPORTED_VERSION, f"Server responded with protocol version {response.get('v')}")
+
+    response_id = response.get("id")
+    # Requests rejected before their ID could be read are answered with a null ID
+    if "error" in response and (response_id is None or response_id == request_id):
+        raise CommandError.fromDict(response["error"])
+    if request_id is not None and response_id != request_id:
+        raise CommandError(ErrorCode.BAD_REQUEST, f"Response ID {response_id} doesn't match request ID {request_id}")
+    if "error" in response:
+        raise CommandError.fromDict(response["error"])
+
+    return response["results"]
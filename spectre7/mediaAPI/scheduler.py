@@ -0,0 +1,56 @@
+import time
+from threading import Event
+
+# Decides how long to wait between MediaAPI updates based on its state, and wakes early when requested.
+class UpdateScheduler:
+
+    # While a title longer than MediaAPI.MAX_TITLE_LENGTH is scrolling
+    SCROLL_INTERVAL = 0.3
+    # Polling mode only, signals make frequent updates unnecessary in event-driven mode
+    PLAYING_INTERVAL = 2.0
+    PAUSED_INTERVAL = 10.0
+    IDLE_INTERVAL = 10.0
+    # Event-driven mode, as a fallback in case a signal was missed
+    EVENT_FALLBACK_INTERVAL = 30.0
+
+    def __init__(self):
+        self._event = Event()
+        self.stopped = False
+
+    # Seconds until the next update should run, or None to wait until woken
+    def getDelay(self, api) -> float | None:
+        delay: float | None
+
+        if api.isScrolling():
+            delay = self.SCROLL_INTERVAL
+        elif api.current_source is None:
+            # Nothing to refresh, new players are announced through NameOwnerChanged
+            delay = None if api.event_driven else self.IDLE_INTERVAL
+        elif api.event_driven:
+            delay = self.EVENT_FALLBACK_INTERVAL
+        elif api.playing:
+            delay = self.PLAYING_INTERVAL
+        else:
+            delay = self.PAUSED_INTERVAL
+
+        hide_deadline = api.getHideDeadline()
+        if hide_deadline is not None:
+            remaining = max(0.0, hide_deadline - time.time())
+            delay = remaining if delay is None else min(delay, remaining)
+
+        return delay
+
+    # Blocks until the next update is due, returns True if it was woken early
+    def wait(self, api) -> bool:
+        if self.stopped:
+            return True
+        woken = self._event.wait(self.getDelay(api))
+        self._event.clear()
+        return woken
+
+    def wake(self):
+        self._event.set()
+
+    def stop(self):
+        self.stopped = True
+        self._event.set()
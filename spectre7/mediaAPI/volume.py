@@ -0,0 +1,280 @@
+import os
+import re
+import select
+from subprocess import check_output
+from threading import Thread, Event, Lock
+from typing import Callable
+from spectre7 import utils
+from spectre7.mediaAPI import metrics
+
+VolumeCallback = Callable[[int, bool], None]
+
+# Keeps track of the system volume and pushes changes to a callback as (volume, muted).
+# Subclasses call _notify() when the mixer changes and implement _applyVolume(), which is run on a separate
+# thread so that only the latest of several quick setVolume() calls is applied.
+class VolumeBackend:
+
+    NAME = "none"
+
+    volume: int = 0
+    muted: bool = False
+    callback: VolumeCallback | None = None
+
+    _pending_volume: int | None = None
+    _set_thread: Thread | None = None
+    _set_event: Event | None = None
+    _stopped: bool = False
+
+    def start(self, callback: VolumeCallback | None = None):
+        self.callback = callback
+        self._set_event = Event()
+        self._set_thread = Thread(target=self._setThread, daemon=True)
+        self._set_thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if (self._set_event is not None):
+            self._set_event.set()
+            self._set_thread.join()
+
+    def getVolume(self) -> tuple[int, bool]:
+        return self.volume, self.muted
+
+    def setVolume(self, value: int):
+        self._pending_volume = max(0, min(100, value))
+        self._set_event.set()
+
+    def _applyVolume(self, value: int):
+        raise NotImplementedError
+
+    def _notify(self, volume: int, muted: bool):
+        if (volume == self.volume and muted == self.muted):
+            return
+        self.volume = volume
+        self.muted = muted
+        if (self.callback):
+            self.callback(volume, muted)
+
+    def _setThread(self):
+        while True:
+            self._set_event.wait()
+            self._set_event.clear()
+            if (self._stopped):
+                return
+
+            value = self._pending_volume
+            self._pending_volume = None
+            if (value is None):
+                continue
+
+            try:
+                self._applyVolume(value)
+            except Exception as e:
+                utils.warn(f"Could not set volume with {self.NAME} backend ({e})")
+
+# Subscribes to sink and server events of PulseAudio or PipeWire (through pipewire-pulse)
+class PulseVolumeBackend(VolumeBackend):
+
+    NAME = "pulse"
+
+    def __init__(self):
+        import pulsectl
+        self._pulsectl = pulsectl
+        self._events = pulsectl.Pulse("MediaAPI-events")
+        self._control = pulsectl.Pulse("MediaAPI")
+        self._control_lock = Lock()
+        self._event_thread: Thread | None = None
+
+    def _getSink(self, pulse):
+        return pulse.get_sink_by_name(pulse.server_info().default_sink_name)
+
+    def _query(self, pulse):
+        with metrics.timer("volume_query"):
+            sink = self._getSink(pulse)
+        self._notify(round(sink.volume.value_flat * 100), bool(sink.mute))
+
+    def start(self, callback: VolumeCallback | None = None):
+        super().start(callback)
+        self._query(self._events)
+
+        self._events.event_mask_set("sink", "server")
+        self._events.event_callback_set(self._onEvent)
+        self._event_thread = Thread(target=self._eventThread, daemon=True)
+        self._event_thread.start()
+
+    def stop(self):
+        super().stop()
+        self._events.event_listen_stop()
+        if (self._event_thread is not None):
+            self._event_thread.join()
+        self._events.close()
+        self._control.close()
+
+    def _onEvent(self, event):
+        # Other calls can't be made from inside the event callback
+        raise self._pulsectl.PulseLoopStop
+
+    def _eventThread(self):
+        while not self._stopped:
+            self._events.event_listen()
+            if (self._stopped):
+                return
+            try:
+                self._query(self._events)
+            except self._pulsectl.PulseError as e:
+                utils.warn(f"Could not query PulseAudio volume ({e})")
+
+    def _applyVolume(self, value: int):
+        with self._control_lock:
+            self._control.volume_set_all_chans(self._getSink(self._control), value / 100.0)
+
+# Waits on the poll descriptors of an ALSA mixer element
+class AlsaVolumeBackend(VolumeBackend):
+
+    NAME = "alsa"
+
+    def __init__(self, control: str = "Master"):
+        import alsaaudio
+        self._alsaaudio = alsaaudio
+        self.control = control
+        self._mixer = alsaaudio.Mixer(control)
+        self._poll_thread: Thread | None = None
+        self._stop_read, self._stop_write = os.pipe()
+
+    def _query(self):
+        with metrics.timer("volume_query"):
+            self._mixer.handleevents()
+            try:
+                muted = bool(self._mixer.getmute()[0])
+            except self._alsaaudio.ALSAAudioError: # control has no playback switch
+                muted = False
+            volume = int(self._mixer.getvolume()[0])
+        self._notify(volume, muted)
+
+    def start(self, callback: VolumeCallback | None = None):
+        super().start(callback)
+        self._query()
+        self._poll_thread = Thread(target=self._pollThread, daemon=True)
+        self._poll_thread.start()
+
+    def stop(self):
+        super().stop()
+        os.write(self._stop_write, b"\0")
+        if (self._poll_thread is not None):
+            self._poll_thread.join()
+        os.close(self._stop_read)
+        os.close(self._stop_write)
+
+    def _pollThread(self):
+        poll = select.poll()
+        poll.register(self._stop_read, select.POLLIN)
+        for fd, mask in self._mixer.polldescriptors():
+            poll.register(fd, mask)
+
+        while not self._stopped:
+            events = poll.poll()
+            if (self._stopped or any(fd == self._stop_read for fd, _ in events)):
+                return
+            self._query()
+
+    def _applyVolume(self, value: int):
+        # Mixer objects are not shared between threads
+        self._alsaaudio.Mixer(self.control).setvolume(value)
+
+# Last resort when neither pulsectl nor pyalsaaudio are available, runs amixer every POLL_INTERVAL seconds
+class AmixerVolumeBackend(VolumeBackend):
+
+    NAME = "amixer"
+    POLL_INTERVAL = 5.0
+
+    cmd = staticmethod(check_output)
+
+    def __init__(self, control: str = "Master"):
+        self.control = control
+        self._poll_thread: Thread | None = None
+        self._stop_event = Event()
+
+    def _query(self):
+        metrics.count("subprocess_spawns")
+        with metrics.timer("volume_query"):
+            data = self.cmd(["amixer", "get", self.control]).decode()
+        match = re.search(r"\[(\d+)%\](?:.*\[(on|off)\])?", data)
+        if (match is None):
+            raise ValueError(f"Unexpected amixer output: {data}")
+        self._notify(int(match.group(1)), match.group(2) == "off")
+
+    def start(self, callback: VolumeCallback | None = None):
+        super().start(callback)
+        self._poll_thread = Thread(target=self._pollThread, daemon=True)
+        self._poll_thread.start()
+
+    def stop(self):
+        super().stop()
+        self._stop_event.set()
+        if (self._poll_thread is not None):
+            self._poll_thread.join()
+
+    def _pollThread(self):
+        # Only reported again once it changes, a failure usually persists
+        last_error: str | None = None
+
+        while True:
+            try:
+                self._query()
+                last_error = None
+            except FileNotFoundError as e:
+                utils.warn(f"amixer is not available, volume won't be tracked ({e})")
+                return
+            except Exception as e:
+                if (str(e) != last_error):
+                    utils.warn(f"Could not query amixer volume ({e})")
+                last_error = str(e)
+            if (self._stop_event.wait(self.POLL_INTERVAL)):
+                return
+
+    def _applyVolume(self, value: int):
+        metrics.count("subprocess_spawns")
+        self.cmd(["amixer", "set", self.control, f"{value}%"])
+        self._query()
+
+# In-memory mixer for tests, call simulateChange() to act like an external volume change
+class FakeVolumeBackend(VolumeBackend):
+
+    NAME = "fake"
+
+    def __init__(self, volume: int = 50, muted: bool = False):
+        self.volume = volume
+        self.muted = muted
+        self.applied: list[int] = []
+
+    def simulateChange(self, volume: int, muted: bool):
+        self._notify(volume, muted)
+
+    def _applyVolume(self, value: int):
+        self.applied.append(value)
+        self._notify(value, self.muted)
+
+BACKENDS = (PulseVolumeBackend, AlsaVolumeBackend, AmixerVolumeBackend)
+
+# Returns the first backend that can be created and started, a backend which fails to start is stopped again
+def startVolumeBackend(callback: VolumeCallback | None = None) -> VolumeBackend:
+    for backend in BACKENDS[:-1]:
+        try:
+            instance = backend()
+        except Exception:
+            continue
+
+        try:
+            instance.start(callback)
+            return instance
+        except Exception as e:
+            utils.warn(f"Could not start {backend.NAME} volume backend, trying the next one ({e})")
+            try:
+                instance.stop()
+            except Exception:
+                pass
+
+    # Never fails to start, errors are reported by its poll thread
+    instance = BACKENDS[-1]()
+    instance.start(callback)
+    return instance
@@ -0,0 +1,157 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from threading import Thread
+from typing import Callable
+from spectre7 import utils
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+
+# Editors often save by writing a temporary file and renaming it over the original, so the directory is watched
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+def _getLibc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _libc
+
+# Calls `callback` on a background thread once the file at `path` was changed, created or removed.
+# Changes are reported after no further change was seen for `debounce` seconds, so that a save made of several
+# writes results in a single call. Uses inotify where available, otherwise the file is polled every POLL_INTERVAL seconds.
+class FileWatcher:
+
+    POLL_INTERVAL = 2.0
+
+    def __init__(self, path: str, callback: Callable[[], None], debounce: float = 0.25):
+        self.path = os.path.abspath(path)
+        self.callback = callback
+        self.debounce = debounce
+        self.uses_inotify = False
+
+        self._directory, self._name = os.path.split(self.path)
+        self._inotify_fd: int | None = None
+        self._thread: Thread | None = None
+        self._stopped = False
+        self._stop_read, self._stop_write = os.pipe()
+
+    def start(self):
+        try:
+            self._inotify_fd = self._openInotify()
+            self.uses_inotify = True
+        except (OSError, AttributeError) as e:
+            utils.warn(f"Could not watch '{self.path}' with inotify, polling it instead ({e})")
+            self._inotify_fd = None
+
+        self._thread = Thread(target=self._inotifyThread if self.uses_inotify else self._pollThread, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        os.write(self._stop_write, b"\0")
+        if (self._thread is not None):
+            self._thread.join()
+        if (self._inotify_fd is not None):
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+        os.close(self._stop_read)
+        os.close(self._stop_write)
+
+    def _openInotify(self) -> int:
+        libc = _getLibc()
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if (fd < 0):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        if (libc.inotify_add_watch(fd, os.fsencode(self._directory), WATCH_MASK) < 0):
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno))
+
+        return fd
+
+    # Returns True if any of the queued events concern the watched file
+    def _readEvents(self) -> bool:
+        try:
+            data = os.read(self._inotify_fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        name = os.fsencode(self._name)
+        relevant = False
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            if (data[offset:offset + length].rstrip(b"\0") == name):
+                relevant = True
+            offset += length
+
+        return relevant
+
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception as e:
+            utils.warn(f"Handling a change of '{self.path}' failed ({e})")
+
+    def _inotifyThread(self):
+        poll = select.poll()
+        poll.register(self._stop_read, select.POLLIN)
+        poll.register(self._inotify_fd, select.POLLIN)
+
+        # Set once a change was seen, until the file stays quiet for the debounce delay
+        pending = False
+
+        while not self._stopped:
+            events = poll.poll(self.debounce * 1000 if pending else None)
+            if (self._stopped or any(fd == self._stop_read for fd, _ in events)):
+                return
+
+            if (len(events) == 0):
+                pending = False
+                self._notify()
+            elif (self._readEvents()):
+                pending = True
+
+    def _stat(self) -> tuple | None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _pollThread(self):
+        poll = select.poll()
+        poll.register(self._stop_read, select.POLLIN)
+
+        last = self._stat()
+        pending = False
+
+        while not self._stopped:
+            if (len(poll.poll((self.debounce if pending else self.POLL_INTERVAL) * 1000)) > 0 or self._stopped):
+                return
+
+            current = self._stat()
+            if (current != last):
+                last = current
+                pending = True
+            elif (pending):
+                pending = False
+                self._notify()
@@ -0,0 +1,86 @@
+import os
+import signal
+import time
+from threading import Timer, Lock
+
+# Signals waybar to refresh the media module, only when the panel state changed.
+# Changes within `window` seconds of each other are sent as a single signal.
+class WaybarNotifier:
+
+    PROCESS_NAME = "waybar"
+    # Seconds before looking for waybar processes again after none were found
+    PID_RESCAN_INTERVAL = 10.0
+
+    def __init__(self, signal_offset: int = 8, window: float = 0.1):
+        self.signal = signal.SIGRTMIN + signal_offset
+        self.window = window
+
+        self.signals_sent: int = 0
+
+        self._last_state: tuple | None = None
+        self._timer: Timer | None = None
+        self._lock = Lock()
+        self._pids: list[int] = []
+        self._pids_time: float = -1
+
+    # Returns True if the state differs from the last one and a signal will be sent
+    def notify(self, state: tuple) -> bool:
+        with self._lock:
+            if (state == self._last_state):
+                return False
+            self._last_state = state
+
+            if (self.window <= 0):
+                self._send()
+            elif (self._timer is None):
+                self._timer = Timer(self.window, self._onTimer)
+                self._timer.daemon = True
+                self._timer.start()
+
+        return True
+
+    def close(self):
+        with self._lock:
+            if (self._timer is not None):
+                self._timer.cancel()
+                self._timer = None
+
+    def _onTimer(self):
+        with self._lock:
+            self._timer = None
+            self._send()
+
+    def _isWaybar(self, pid: int | str) -> bool:
+        try:
+            with open(f"/proc/{pid}/comm", "r") as f:
+                return f.read().strip() == self.PROCESS_NAME
+        except OSError:
+            return False
+
+    def _findPids(self) -> list[int]:
+        return [int(entry) for entry in os.listdir("/proc") if entry.isdigit() and self._isWaybar(entry)]
+
+    def _getPids(self, rescan: bool = False) -> list[int]:
+        if (rescan or (len(self._pids) == 0 and time.monotonic() - self._pids_time > self.PID_RESCAN_INTERVAL)):
+            self._pids = self._findPids()
+            self._pids_time = time.monotonic()
+        return self._pids
+
+    def _kill(self, pids: list[int]) -> bool:
+        success = True
+        for pid in pids:
+            # The PID of a waybar which exited may have been reused by another process, which the signal would terminate
+            if (not self._isWaybar(pid)):
+                success = False
+                continue
+            try:
+                os.kill(pid, self.signal)
+            except (ProcessLookupError, PermissionError):
+                success = False
+        return success
+
+    def _send(self):
+        # A failed kill means waybar exited or restarted, so the cached PIDs are refreshed once
+        if (not self._kill(self._getPids())):
+            self._kill(self._getPids(rescan=True))
+        self.signals_sent += 1
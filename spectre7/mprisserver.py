@@ -1,25 +1,268 @@
 from pydbus import Variant, connect as DBusConnect
 from pydbus.generic import signal
 from gi.repository import GLib
-from threading import Thread
-
+from threading import Thread, Lock
+from itertools import count
+import asyncio
+import os
+import time
+from spectre7 import utils
+
+class MetadataTypeError(TypeError):
+    def __init__(self, key: str, value: any):
+        super().__init__(f"Metadata value of '{key}' has unsupported type {value.__class__.__name__}")
+        self.key = key
+        self.value = value
+
+# (key, type name) pairs which were already reported, so that a player with a bad field doesn't flood the log
+_reported_type_errors: set[tuple[str, str]] = set()
+
+def _reportTypeError(e: MetadataTypeError):
+    report = (e.key, e.value.__class__.__name__)
+    if report in _reported_type_errors:
+        return
+    _reported_type_errors.add(report)
+    utils.warn(e)
+
+# Returns the Variant of a single metadata field, or None if the field should be left out
+def encodeMetadataValue(key: str, value: any) -> Variant | None:
+    if value is None:
+        return None
+    elif isinstance(value, str):
+        return Variant("o" if key == "mpris:trackid" else "s", value)
+    elif isinstance(value, int) or isinstance(value, float):
+        return Variant("x" if key == "mpris:length" else "i", int(value))
+    elif isinstance(value, (list, tuple)):
+        return Variant("as", [str(item) for item in value])
+    else:
+        raise MetadataTypeError(key, value)
+
+# Type of the dicts returned by MprisMetadata.getVariants(), which are replaced rather than modified
+class EncodedMetadata(dict):
+    pass
+
+# Whether a property value can't change without being replaced, so that comparing it to the last emitted one is enough
+def isImmutable(value: any) -> bool:
+    if value is None or isinstance(value, (str, bytes, int, float, Variant, EncodedMetadata)):
+        return True
+    if isinstance(value, tuple):
+        return all(isImmutable(item) for item in value)
+    return False
+
+# Metadata of a track, encoded into Variants when first read and reused until a field changes.
+# Values are plain Python values as accepted by encodeMetadataValue().
+class MprisMetadata:
+
+    def __init__(self, fields: dict[str, any] | None = None):
+        self.fields: dict[str, any] = {}
+        # Incremented whenever a field changes
+        self.version = 0
+        self._variants: dict[str, Variant] = {}
+        self._encoded: dict[str, Variant] | None = None
+        if fields:
+            self._load(fields)
+
+    # update() without comparing against existing fields, for new instances
+    def _load(self, fields: dict[str, any]):
+        for key, value in fields.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple)):
+                value = tuple(map(str, value))
+            elif not isinstance(value, (str, int, float)):
+                _reportTypeError(MetadataTypeError(key, value))
+                continue
+            self.fields[key] = value
+
+    def get(self, key: str, default: any = None) -> any:
+        return self.fields.get(key, default)
+
+    # Sets the given fields and returns the keys whose value changed, None values remove a field
+    def update(self, fields: dict[str, any]) -> set[str]:
+        changed = set()
+
+        for key, value in fields.items():
+            # Compared in the form they are encoded in
+            if isinstance(value, (list, tuple)):
+                value = tuple(map(str, value))
+
+            if value is None:
+                if key in self.fields:
+                    del self.fields[key]
+                    self._variants.pop(key, None)
+                    changed.add(key)
+                continue
+
+            if self.fields.get(key) == value and key in self.fields:
+                continue
+
+            if not isinstance(value, (str, int, float, tuple)):
+                _reportTypeError(MetadataTypeError(key, value))
+                continue
+
+            self.fields[key] = value
+            self._variants.pop(key, None)
+            changed.add(key)
+
+        if changed:
+            self.version += 1
+            self._encoded = None
+        return changed
+
+    # Replaces every field, returns the keys which changed including removed ones
+    def replace(self, fields: dict[str, any]) -> set[str]:
+        removed = {key: None for key in self.fields if fields.get(key) is None}
+        return self.update(removed | fields)
+
+    # Returns the changed keys
+    def diff(self, other: "MprisMetadata") -> set[str]:
+        return {key for key in self.fields.keys() | other.fields.keys() if self.fields.get(key) != other.fields.get(key)}
+
+    # The a{sv} value of the Metadata property. The same dict is returned until a field changes, it must not be modified.
+    def getVariants(self) -> "EncodedMetadata":
+        if self._encoded is None:
+            for key, value in self.fields.items():
+                if key not in self._variants:
+                    self._variants[key] = encodeMetadataValue(key, value)
+            self._encoded = EncodedMetadata(self._variants)
+        return self._encoded
+
+# Extrapolates the playback position (in microseconds) from the last one reported by the player,
+# so that reads of Position don't need to query the player.
+class PositionTracker:
+
+    # Reported positions further than this from the extrapolated one are treated as seeks
+    SEEK_TOLERANCE = 500000
+
+    def __init__(self, position: int = 0, rate: float = 1.0, playing: bool = False):
+        self.rate = rate
+        self.playing = playing
+        # Known track length, positions are not extrapolated past it
+        self.length: int | None = None
+        self._anchor(position)
+
+    def _anchor(self, position: int):
+        self.anchor_position = max(0, int(position))
+        self.anchor_time = time.monotonic()
+
+    def getPosition(self) -> int:
+        position = self.anchor_position
+        if self.playing:
+            position += int((time.monotonic() - self.anchor_time) * self.rate * 1000000)
+        if self.length is not None and position > self.length:
+            return self.length
+        return position
+
+    def setPlaying(self, playing: bool):
+        if playing != self.playing:
+            self._anchor(self.getPosition())
+            self.playing = playing
+
+    def setRate(self, rate: float):
+        if rate != self.rate:
+            self._anchor(self.getPosition())
+            self.rate = rate
+
+    # Restarts from `position` without it counting as a seek, e.g. when the track changes
+    def reset(self, position: int = 0, length: int | None = None):
+        self.length = length
+        self._anchor(position)
+
+    # Re-anchors to a position reported by the player, returns True if it doesn't match the extrapolated one
+    def update(self, position: int) -> bool:
+        discontinuous = abs(position - self.getPosition()) > self.SEEK_TOLERANCE
+        self._anchor(position)
+        return discontinuous
+
+# Placeholder for pending properties whose value is read when they are emitted
+_READ = object()
+_flush_ids = count(1)
+
+# Property changes are collected and sent as a single PropertiesChanged signal per interface.
+# They are emitted on the next main loop iteration, or after COALESCE_WINDOW seconds if it is above 0.
 class MprisInterface:
     TIME_UNIT = 1000000
     INTERFACE = None
     PropertiesChanged = signal()
 
+    COALESCE_WINDOW = 0.0
+
+    # Last emitted value of each property, unchanged properties are not emitted again
+    # Only values which can't be modified in place are kept, others are always emitted
+    _emitted: dict[str, any] | None = None
+
+    # Property name -> value or _READ, waiting to be emitted
+    _pending: dict[str, any] | None = None
+    # Identifies the scheduled flush, None if there is none
+    _flush_id: int | None = None
+    _flush_source: int | None = None
+    _pending_lock = Lock()
+
+    # Queues properties to be emitted. Properties without a value (given in a list, or as None in a dict) are read when emitted.
     def notifyPropertyChanged(self, properties: dict[str, any] | list[str] | str):
 
         if isinstance(properties, list):
-            properties = {property: getattr(self, property) for property in properties}
+            properties = dict.fromkeys(properties, _READ)
         elif isinstance(properties, str):
-            properties = {properties: getattr(self, properties)}
+            properties = {properties: _READ}
         else:
-            for key in properties:
-                if properties[key] is None:
-                    properties[key] = getattr(self, key)
+            properties = {key: _READ if value is None else value for key, value in properties.items()}
 
-        self.PropertiesChanged(self.INTERFACE, properties, [])
+        with self._pending_lock:
+            if self._pending is None:
+                self._pending = {}
+            self._pending.update(properties)
+
+            if self._flush_id is None:
+                self._flush_id = next(_flush_ids)
+                if self.COALESCE_WINDOW > 0:
+                    self._flush_source = GLib.timeout_add(int(self.COALESCE_WINDOW * 1000), self._onFlush, self._flush_id)
+                else:
+                    self._flush_source = GLib.idle_add(self._onFlush, self._flush_id)
+
+    # Emits queued properties immediately
+    def flushPropertyChanges(self):
+        with self._pending_lock:
+            if self._flush_source is not None:
+                GLib.source_remove(self._flush_source)
+            self._flush_id = None
+            self._flush_source = None
+        self._emitPending()
+
+    def _onFlush(self, flush_id: int) -> bool:
+        with self._pending_lock:
+            # Already flushed synchronously
+            if flush_id != self._flush_id:
+                return False
+            self._flush_id = None
+            self._flush_source = None
+        self._emitPending()
+        return False
+
+    def _emitPending(self):
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = None
+        if not pending:
+            return
+
+        if self._emitted is None:
+            self._emitted = {}
+
+        changed = {}
+        for key, value in pending.items():
+            if value is _READ:
+                value = getattr(self, key)
+            if not isImmutable(value):
+                self._emitted.pop(key, None)
+            elif key in self._emitted and (self._emitted[key] is value or self._emitted[key] == value):
+                continue
+            else:
+                self._emitted[key] = value
+            changed[key] = value
+
+        if changed:
+            self.PropertiesChanged(self.INTERFACE, changed, [])
 
 class MprisMainInterface(MprisInterface):
     INTERFACE = "org.mpris.MediaPlayer2"
@@ -69,7 +312,6 @@ class MprisPlayerInterface(MprisInterface):
     dbus = f"""
     <node>
       <interface name="{INTERFACE}">
-        <method name="Next"/>
         <method name="Next"/>
         <method name="Previous"/>
         <method name="Pause"/>
@@ -181,32 +423,76 @@ class MprisPlayerInterface(MprisInterface):
         if not self.CanControl:
             return
 
+    # Encodes the values of a metadata dict in place, fields with unsupported values are dropped.
+    # Prefer setMetadata(), which only encodes fields when they change.
     def formatMetadata(self, metadata: dict) -> None:
         for key in list(metadata.keys()):
-            value = metadata[key]
-
             try:
-                if value is None:
-                    metadata.pop(key)
-                elif isinstance(value, str):
-                    metadata[key] = Variant("o" if key == "mpris:trackid" else "s", value)
-                elif isinstance(value, int) or isinstance(value, float):
-                    metadata[key] = Variant("x" if key == "mpris:length" else "i", int(value))
-                elif isinstance(value, list):
-                    for i in range(len(value)):
-                        value[i] = str(value[i])
-                    metadata[key] = Variant("as", value)
-                else:
-                    raise TypeError(value, value.__class__)
+                variant = encodeMetadataValue(key, metadata[key])
+            except MetadataTypeError as e:
+                _reportTypeError(e)
+                variant = None
 
-            except Exception as e:
-                import notify2
-                notify2.init("bruh")
-                notify2.Notification(str(e)).show()
+            if variant is None:
+                metadata.pop(key)
+            else:
+                metadata[key] = variant
 
+    _metadata: MprisMetadata | None = None
+
+    @property
+    def metadata(self) -> MprisMetadata:
+        if self._metadata is None:
+            self._metadata = MprisMetadata()
+        return self._metadata
+
+    # Replaces (or with replace=False, updates) the track metadata and emits Metadata if anything changed.
+    # Returns the changed keys.
+    def setMetadata(self, fields: dict[str, any], replace: bool = True, notify: bool = True) -> set[str]:
+        changed = self.metadata.replace(fields) if replace else self.metadata.update(fields)
+
+        # A new track starts from 0 without a Seeked signal
+        if self._position_tracker is not None:
+            if "mpris:trackid" in changed:
+                self._position_tracker.reset(0, self.metadata.get("mpris:length"))
+            elif "mpris:length" in changed:
+                self._position_tracker.length = self.metadata.get("mpris:length")
+
+        if changed and notify:
+            self.notifyPropertyChanged("Metadata")
+        return changed
+
+    _position_tracker: PositionTracker | None = None
+
+    # Created on first use, after which the default Position property is answered by it
+    @property
+    def position_tracker(self) -> PositionTracker:
+        if self._position_tracker is None:
+            self._position_tracker = PositionTracker(0, self.Rate, self.PlaybackStatus == "Playing")
+            self._position_tracker.length = self.metadata.get("mpris:length")
+        return self._position_tracker
+
+    # Passes a position from the player to the tracker, emitting Seeked if it jumped or if `seeked` is set
+    def reportPosition(self, position: int, seeked: bool = False):
+        if self.position_tracker.update(position) or seeked:
+            self.Seeked(int(position))
+
+    # Call when the playback status changes, so that the position stops or starts advancing from the right point
+    def updatePlaybackStatus(self, status: str, notify: bool = True):
+        self.position_tracker.setPlaying(status == "Playing")
+        if notify:
+            self.notifyPropertyChanged({"PlaybackStatus": status})
+
+    def updateRate(self, rate: float, notify: bool = True):
+        self.position_tracker.setRate(rate)
+        if notify:
+            self.notifyPropertyChanged({"Rate": rate})
 
     @property
     def Metadata(self) -> dict:
+        if self._metadata is not None:
+            return self._metadata.getVariants()
+
         # ret =  {
         #     "mpris:trackid": "/track/0",
         #     "mpris:artUrl": None,
@@ -236,7 +522,9 @@ class MprisPlayerInterface(MprisInterface):
         print(value)
 
     @property
-    def Position(self):
+    def Position(self) -> int:
+        if self._position_tracker is not None:
+            return self._position_tracker.getPosition()
         return 0
 
     @property
@@ -273,6 +561,118 @@ class MprisPlayerInterface(MprisInterface):
     def CanControl(self) -> bool:
         return True
 
+NO_TRACK = "/org/mpris/MediaPlayer2/TrackList/NoTrack"
+
+# Ordered tracks keyed by track ID, stored as a doubly linked list inside a dict.
+# Lookups, insertions after a given track and removals are O(1).
+class TrackList:
+
+    def __init__(self):
+        # Track ID -> [previous ID, next ID, metadata]
+        self._nodes: dict[str, list] = {}
+        self._first: str | None = None
+        self._last: str | None = None
+        self._ids: list[str] | None = None
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self._nodes
+
+    def __iter__(self):
+        track_id = self._first
+        while track_id is not None:
+            yield track_id
+            track_id = self._nodes[track_id][1]
+
+    def get(self, track_id: str) -> MprisMetadata | None:
+        node = self._nodes.get(track_id)
+        return node[2] if node is not None else None
+
+    # The ID of the track before `track_id`, NO_TRACK if it is the first one
+    def getPrevious(self, track_id: str) -> str:
+        previous = self._nodes[track_id][0]
+        return previous if previous is not None else NO_TRACK
+
+    # Track IDs in order. The same list is returned until the tracks change, it must not be modified.
+    def getIds(self) -> list[str]:
+        if self._ids is None:
+            self._ids = list(self)
+        return self._ids
+
+    # Inserts a track after `after_track`, or first if it is NO_TRACK. Raises KeyError if after_track isn't in the list.
+    def insertAfter(self, track_id: str, fields: dict[str, any], after_track: str = NO_TRACK) -> MprisMetadata:
+        if track_id in self._nodes:
+            raise ValueError(f"Track '{track_id}' is already in the list")
+
+        if after_track == NO_TRACK:
+            previous, next = None, self._first
+        else:
+            previous, next = after_track, self._nodes[after_track][1]
+
+        metadata = MprisMetadata(fields | {"mpris:trackid": track_id})
+        self._nodes[track_id] = [previous, next, metadata]
+
+        if previous is None:
+            self._first = track_id
+        else:
+            self._nodes[previous][1] = track_id
+        if next is None:
+            self._last = track_id
+        else:
+            self._nodes[next][0] = track_id
+
+        self._ids = None
+        return metadata
+
+    def append(self, track_id: str, fields: dict[str, any]) -> MprisMetadata:
+        return self.insertAfter(track_id, fields, self._last if self._last is not None else NO_TRACK)
+
+    # Returns False if the track wasn't in the list
+    def remove(self, track_id: str) -> bool:
+        node = self._nodes.pop(track_id, None)
+        if node is None:
+            return False
+
+        previous, next, _ = node
+        if previous is None:
+            self._first = next
+        else:
+            self._nodes[previous][1] = next
+        if next is None:
+            self._last = previous
+        else:
+            self._nodes[next][0] = previous
+
+        self._ids = None
+        return True
+
+    # Returns the changed keys, raises KeyError if the track isn't in the list
+    def update(self, track_id: str, fields: dict[str, any]) -> set[str]:
+        return self._nodes[track_id][2].update(fields)
+
+    # Replaces every track with (track ID, fields) pairs
+    def replace(self, tracks: list[tuple[str, dict[str, any]]]):
+        ids = [track_id for track_id, _ in tracks]
+        nodes = {}
+        # Linked in a single pass instead of through append()
+        for i, (track_id, fields) in enumerate(tracks):
+            nodes[track_id] = [ids[i - 1] if i > 0 else None, ids[i + 1] if i + 1 < len(ids) else None, MprisMetadata(fields | {"mpris:trackid": track_id})]
+
+        if len(nodes) != len(ids):
+            raise ValueError("Track IDs must be unique")
+
+        self._nodes = nodes
+        self._first = ids[0] if ids else None
+        self._last = ids[-1] if ids else None
+        self._ids = ids
+
+    # Encoded metadata of the given tracks in order, unknown IDs are skipped
+    def getVariants(self, track_ids: list[str]) -> list[dict]:
+        nodes = self._nodes
+        return [nodes[track_id][2].getVariants() for track_id in track_ids if track_id in nodes]
+
 class MprisTrackInterface(MprisInterface):
     INTERFACE = MprisMainInterface.INTERFACE + ".Tracklist"
     dbus = f"""
@@ -319,26 +719,93 @@ class MprisTrackInterface(MprisInterface):
     TrackRemoved = signal()
     TrackMetadataChanged = signal()
 
-    def GetTracksMetadata(self, track_ids: list[str]) -> dict:
-        return {}
+    _tracklist: TrackList | None = None
+
+    @property
+    def tracklist(self) -> TrackList:
+        if self._tracklist is None:
+            self._tracklist = TrackList()
+        return self._tracklist
+
+    # The following change the tracklist and emit the matching signals
+
+    def addTrack(self, track_id: str, fields: dict[str, any], after_track: str = NO_TRACK):
+        metadata = self.tracklist.insertAfter(track_id, fields, after_track)
+        self.TrackAdded(metadata.getVariants(), self.tracklist.getPrevious(track_id))
+
+    def appendTrack(self, track_id: str, fields: dict[str, any]):
+        metadata = self.tracklist.append(track_id, fields)
+        self.TrackAdded(metadata.getVariants(), self.tracklist.getPrevious(track_id))
+
+    def removeTrack(self, track_id: str):
+        if self.tracklist.remove(track_id):
+            self.TrackRemoved(track_id)
+
+    def updateTrack(self, track_id: str, fields: dict[str, any]):
+        if self.tracklist.update(track_id, fields):
+            self.TrackMetadataChanged(track_id, self.tracklist.get(track_id).getVariants())
 
+    def replaceTracks(self, tracks: list[tuple[str, dict[str, any]]], current_track: str = NO_TRACK):
+        self.tracklist.replace(tracks)
+        self.TrackListReplaced(self.tracklist.getIds(), current_track)
+
+    def GetTracksMetadata(self, track_ids: list[str]) -> list[dict]:
+        return self.tracklist.getVariants(track_ids)
+
+    # Players have to resolve the URI themselves before calling addTrack()
     def AddTrack(self, uri: str, after_track: str, set_as_current: bool):
         pass
 
     def RemoveTrack(self, track_id: str):
-        pass
+        if not self.CanEditTracks:
+            return
+        self.removeTrack(track_id)
 
     def GoTo(self, track_id: str):
         pass
 
     @property
     def Tracks(self) -> list[str]:
-        return []
+        return self.tracklist.getIds()
 
     @property
     def CanEditTracks(self) -> bool:
         return True
 
+def getSessionBusAddress() -> str:
+    address = os.environ.get("DBUS_SESSION_BUS_ADDRESS")
+    if address:
+        return address
+    return f"unix:path={os.environ.get('XDG_RUNTIME_DIR', f'/run/user/{os.getuid()}')}/bus"
+
+# Address -> [bus, number of users], so that every server on the same bus shares one connection
+_connections: dict[str, list] = {}
+_connections_lock = Lock()
+
+def acquireBus(address: str):
+    with _connections_lock:
+        entry = _connections.get(address)
+        if entry is None:
+            entry = _connections[address] = [DBusConnect(address), 0]
+        entry[1] += 1
+        return entry[0]
+
+# Closes the connection once its last user released it
+def releaseBus(address: str):
+    with _connections_lock:
+        entry = _connections.get(address)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _connections[address]
+
+    try:
+        entry[0].con.close_sync(None)
+    except Exception as e:
+        utils.warn(f"Could not close D-Bus connection to '{address}' ({e})")
+
 class MprisServer():
     
     LOOP = GLib.MainLoop()
@@ -347,6 +814,7 @@ class MprisServer():
     def __init__(self, name: str):
         self.name = name
         self.token = None
+        self.address: str | None = None
 
         self.main_interface = MprisMainInterface()
         self.player_interface = MprisPlayerInterface()
@@ -357,6 +825,12 @@ class MprisServer():
         thread = Thread(target = MprisServer.LOOP.run)
         thread.start()
         return thread
+
+    @staticmethod
+    def stopLoop(thread: Thread | None = None):
+        MprisServer.LOOP.quit()
+        if thread is not None:
+            thread.join()
     
     def setMainInterface(self, interface: MprisMainInterface):
         self.main_interface = interface
@@ -370,8 +844,14 @@ class MprisServer():
     def isPublished(self) -> bool:
         return self.token is not None
 
-    def publish(self):
-        bus = DBusConnect("unix:path=/run/user/1000/bus")
+    def getInterfaces(self) -> list[MprisInterface]:
+        return [interface for interface in (self.main_interface, self.player_interface, self.track_interface) if interface is not None]
+
+    # Publishes on the session bus unless another address is given, sharing the connection with other servers
+    def publish(self, address: str | None = None):
+        if address is None:
+            address = getSessionBusAddress()
+        bus = acquireBus(address)
 
         interface = "/" + MprisMainInterface.INTERFACE.replace(".", "/")
         args = [MprisMainInterface.INTERFACE + "." + self.name, (interface, self.main_interface), (interface, self.player_interface)]
@@ -380,9 +860,102 @@ class MprisServer():
             self.main_interface.HasTrackList = True 
             args.append((interface, self.track_interface))
 
-        self.token = bus.publish(*args)
+        try:
+            self.token = bus.publish(*args)
+        except Exception:
+            releaseBus(address)
+            raise
+        self.address = address
 
     def unpublish(self):
         if self.token:
+            for interface in self.getInterfaces():
+                interface.flushPropertyChanges()
             self.token.unpublish()
             self.token = None
+            releaseBus(self.address)
+            self.address = None
+
+# Publishes any number of servers on one bus connection and runs the GLib main loop which serves them.
+# Either call run() to block, start() to run the loop on a thread, or await serve() from asyncio code.
+class MprisRuntime:
+
+    def __init__(self, address: str | None = None):
+        self.address = address if address is not None else getSessionBusAddress()
+        self.servers: list[MprisServer] = []
+        self.loop = GLib.MainLoop()
+        self.thread: Thread | None = None
+        self._lock = Lock()
+
+    def publish(self, server: MprisServer) -> MprisServer:
+        server.publish(self.address)
+        with self._lock:
+            self.servers.append(server)
+        return server
+
+    def unpublish(self, server: MprisServer):
+        with self._lock:
+            if server not in self.servers:
+                return
+            self.servers.remove(server)
+        server.unpublish()
+
+    def run(self):
+        try:
+            self.loop.run()
+        finally:
+            self._unpublishAll()
+
+    def start(self) -> Thread:
+        if self.thread is None:
+            self.thread = Thread(target=self.loop.run, daemon=True)
+            self.thread.start()
+        return self.thread
+
+    # Unpublishes every server after sending their pending property changes, then stops the loop
+    def stop(self):
+        self._unpublishAll()
+        self.loop.quit()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _unpublishAll(self):
+        with self._lock:
+            servers = self.servers
+            self.servers = []
+        for server in servers:
+            server.unpublish()
+
+    # Runs `function` on the GLib loop and returns its result to the awaiting asyncio task
+    async def call(self, function, *args) -> any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result: any, exception: Exception | None):
+            if future.done():
+                return
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+        def run() -> bool:
+            try:
+                result = function(*args)
+            except Exception as e:
+                loop.call_soon_threadsafe(resolve, None, e)
+            else:
+                loop.call_soon_threadsafe(resolve, result, None)
+            return False
+
+        GLib.idle_add(run)
+        return await future
+
+    # Runs the loop on its thread until stop() is called or the awaiting task is cancelled
+    async def serve(self):
+        thread = self.start()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
+        finally:
+            await asyncio.to_thread(self.stop)
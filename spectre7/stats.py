@@ -0,0 +1,18 @@
+# Statistics shared by the benchmarks, kept free of dependencies so that any of them can import it
+
+def summarise(values: list[float]) -> dict:
+    if len(values) == 0:
+        return {"count": 0}
+
+    values = sorted(values)
+    def percentile(p: float) -> float:
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(50),
+        "p90": percentile(90),
+        "p99": percentile(99),
+        "max": values[-1],
+    }
@@ -5,12 +5,22 @@ import os
 import pyperclip
 from pyyoutube import Api as PyyApi
 import shutil
+import subprocess
+import threading
+import time
 import urllib.request
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable
 
 import utils
 
 youtubedl_command = "yt-dlp"
+# Amount of videos downloaded at once by the playlist and album modes
+download_workers = 4
+# Times a failed download is retried, waiting retry_delay seconds longer before each attempt
+download_retries = 2
+retry_delay = 5
 # download_directory = os.path.expanduser("/run/media/spectre7/Jedi Archives/YTD/")
 download_directory = os.path.expanduser("~/Downloads/YTD/")
 # download_directory = os.path.expanduser("ftp://192.168.10.222/mnt/jediarchives/YTD")
@@ -37,6 +47,18 @@ def get_playlist_videos(playlist_url: str, playlist_range: list = [0, 0]):
 
     return out
 
+# Returns the titles of videos by ID, the API accepts up to 50 IDs per request
+def get_video_titles(video_ids: list) -> dict:
+    titles = {}
+    for i in range(0, len(video_ids), 50):
+        for video in pyyapi.get_video_by_id(video_id=video_ids[i:i + 50]).items:
+            titles[video.id] = video.snippet.title
+    return titles
+
+def get_video_url(video_id: str):
+    # IDs may start with a dash, which yt-dlp would take as an option
+    return "https://www.youtube.com/watch?v=" + video_id
+
 def execute_dl_command(url: str, args: str, dir: str = download_directory):
     dir = dir.replace("'", "").replace(".", "")
     os.makedirs(dir, exist_ok=True)
@@ -44,6 +66,120 @@ def execute_dl_command(url: str, args: str, dir: str = download_directory):
     command = "cd '" + dir + "' && " + youtubedl_command + " " + url + " -f 'bestvideo[height<=" + res + "]+bestaudio/best[height<=" + res + "]' " + args
     os.system(command)
 
+class DownloadError(Exception):
+    pass
+
+# Downloads videos into `dir` on a pool of `workers` yt-dlp processes, retrying each failed download.
+# Each downloaded file is passed to `process` as (index in video_ids, video ID, path) on a single separate thread, so
+# that tagging and renaming never hold up a download slot. Indices stay those of the playlist whatever order downloads
+# finish in. Progress and throughput are printed whenever a download finishes.
+class DownloadScheduler:
+
+    # Files which yt-dlp is still writing to
+    PARTIAL_SUFFIXES = (".part", ".ytdl", ".temp")
+
+    def __init__(self, dir: str, args: list, output_template: str = "%(title)s [%(id)s].%(ext)s", process: Callable[[int, str, str], None] = None, workers: int = None, retries: int = None):
+        self.dir = dir
+        self.args = args
+        self.output_template = output_template
+        self.process = process
+        self.workers = workers if workers is not None else download_workers
+        self.retries = retries if retries is not None else download_retries
+
+        self.total = 0
+        self.downloaded = 0
+        self.processed = 0
+        self.failed = {}
+        self.downloaded_bytes = 0
+        self.start_time = 0.0
+        self.lock = threading.Lock()
+
+    # Downloads and processes every video, returns the IDs which failed with their errors
+    def run(self, video_ids: list) -> dict:
+        os.makedirs(self.dir, exist_ok=True)
+        self.total = len(video_ids)
+        self.start_time = time.time()
+
+        download_pool = ThreadPoolExecutor(self.workers, thread_name_prefix="ytd-download")
+        process_pool = ThreadPoolExecutor(1, thread_name_prefix="ytd-process")
+
+        def downloaded(index: int, video_id: str, future):
+            try:
+                path = future.result()
+            except Exception as e:
+                self.report_failure(video_id, e)
+                return
+
+            if self.process is not None:
+                process_pool.submit(self.process_file, index, video_id, path)
+
+        try:
+            futures = []
+            for index, video_id in enumerate(video_ids):
+                future = download_pool.submit(self.download, video_id)
+                future.add_done_callback(lambda future, index=index, video_id=video_id: downloaded(index, video_id, future))
+                futures.append(future)
+            wait(futures)
+        finally:
+            download_pool.shutdown(wait=True)
+            process_pool.shutdown(wait=True)
+
+        self.print_progress("Finished")
+        return self.failed
+
+    def download(self, video_id: str) -> str:
+        command = [youtubedl_command, get_video_url(video_id), "--no-playlist", "--quiet", "--no-warnings", "--output", self.output_template] + self.args
+        error = ""
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(retry_delay * attempt)
+                with self.lock:
+                    print(f"Retrying {video_id} ({attempt}/{self.retries}): {error}")
+
+            result = subprocess.run(command, cwd=self.dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if result.returncode == 0:
+                path = self.find_file(video_id)
+                if path is not None:
+                    with self.lock:
+                        self.downloaded += 1
+                        self.downloaded_bytes += os.path.getsize(path)
+                    self.print_progress("Downloaded " + video_id)
+                    return path
+                error = "Downloaded file not found"
+            else:
+                lines = result.stderr.strip().splitlines()
+                error = lines[-1] if len(lines) > 0 else "yt-dlp exited with code " + str(result.returncode)
+
+        raise DownloadError(error)
+
+    def find_file(self, video_id: str):
+        for file in os.listdir(self.dir):
+            if video_id in file and not file.endswith(self.PARTIAL_SUFFIXES):
+                return os.path.join(self.dir, file)
+        return None
+
+    def process_file(self, index: int, video_id: str, path: str):
+        try:
+            self.process(index, video_id, path)
+        except Exception as e:
+            self.report_failure(video_id, e)
+            return
+
+        with self.lock:
+            self.processed += 1
+
+    def report_failure(self, video_id: str, error: Exception):
+        with self.lock:
+            self.failed[video_id] = str(error)
+        self.print_progress("Failed " + video_id + " (" + str(error) + ")")
+
+    def print_progress(self, event: str):
+        with self.lock:
+            elapsed = max(time.time() - self.start_time, 0.001)
+            megabytes = self.downloaded_bytes / 1024 / 1024
+            print(f"[{self.downloaded}/{self.total}] {event} | {self.processed} processed, {len(self.failed)} failed | {megabytes:.1f} MB, {megabytes / elapsed:.2f} MB/s, {self.downloaded / elapsed * 60:.1f} videos/min")
+
 def mode_single_video(url: str):
     execute_dl_command(url, "--no-playlist")
 
@@ -74,14 +210,23 @@ def mode_playlist(url: str):
         if suffix != "":
             dir += "_" + str(suffix)
 
-    # yt-dlp doesn't download the playlist for some reason when using a video/playlist link
-    url = utils.parse_url(url)["list"]
-
     first = input("Input number (i+1) of the first video to download: ")
     last = input("Input number (i+1) of the last video to download: ")
+    playlist_range = [int(first) if first.strip().isdigit() else 0, int(last) if last.strip().isdigit() else 0]
+
+    # Videos are downloaded separately so that several can be downloaded at once
+    playlist_videos = get_playlist_videos(url, playlist_range)
+    res = "720"
+    failed = DownloadScheduler(dir, ["-f", "bestvideo[height<=" + res + "]+bestaudio/best[height<=" + res + "]"]).run(playlist_videos)
+    print_failures(failed)
+
+def print_failures(failed: dict):
+    if len(failed) == 0:
+        return
+    print(f"{len(failed)} video(s) failed:")
+    for video_id, error in failed.items():
+        print(" - " + get_video_url(video_id) + ": " + error)
 
-    execute_dl_command(url, "--yes-playlist --playlist-start " + first + " --playlist-end " + last + suffix, dir)
-import time
 def mode_album(url: str):
 
     # Check if URL is a playlist
@@ -143,23 +288,25 @@ def mode_album(url: str):
         urllib.request.urlretrieve(album_data["cover_path"], dir + "/thumbnail" + ext)
         album_data["cover_path"] = dir + "/thumbnail" + ext
 
-    # processed_files = ["thumbnail.jpg"]
-    for i, video_id in enumerate(playlist_videos):
-        execute_dl_command(video_id, "--no-playlist --extract-audio --audio-quality 0 --audio-format mp3 -f bestaudio", dir)
-        # print("Sleep start")
-        # time.sleep(2)
-        # print("Sleep end")
-
-        for file in os.listdir(dir):
-            if video_id in file:
-                break
-        
-        title = pyyapi.get_video_by_id(video_id=video_id).items[0].snippet.title.removeprefix(album_data["prefix"]).removesuffix(album_data["suffix"])
-        utils.set_audio_metadata(dir + "/" + file, i + 1, title, album_data)
-        os.rename(dir + "/" + file, dir + "/" + title + ".mp3")
-
-        # processed_files.append(title + ".mp3")
-        # print("Processed: " + str(processed_files))
+    titles = get_video_titles(playlist_videos)
+
+    # Runs on the scheduler's processing thread, the track number comes from the playlist order
+    def tag(index: int, video_id: str, path: str):
+        title = titles[video_id] if video_id in titles else pyyapi.get_video_by_id(video_id=video_id).items[0].snippet.title
+        title = title.removeprefix(album_data["prefix"]).removesuffix(album_data["suffix"])
+        utils.set_audio_metadata(path, index + 1, title, album_data)
+
+        # Tracks with the same title would overwrite each other
+        name = title.replace("/", "_")
+        target = dir + "/" + name + ".mp3"
+        duplicate = 2
+        while os.path.exists(target):
+            target = dir + "/" + name + " (" + str(duplicate) + ").mp3"
+            duplicate += 1
+        os.rename(path, target)
+
+    scheduler = DownloadScheduler(dir, ["--extract-audio", "--audio-quality", "0", "--audio-format", "mp3", "-f", "bestaudio"], output_template="%(id)s.%(ext)s", process=tag)
+    print_failures(scheduler.run(playlist_videos))
 
 modes = {
     "Single video": mode_single_video,